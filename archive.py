@@ -0,0 +1,163 @@
+import io
+import json
+import time
+import tarfile
+import zipfile
+
+from music.create_midi import GenerationPlan
+from music.parallel import generate_shared
+
+
+archive_formats = ['tar', 'zip']
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only binary file over a bytes-like buffer whose read() returns views of the 
+    buffer instead of copies, so that tarfile writes a song from shared memory directly.
+    """
+    def __init__(self, data):
+        self.data = memoryview(data).cast('B')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        stop = len(self.data) if size is None or size < 0 else min(self.position + size, len(self.data))
+        view = self.data[self.position:stop]
+        self.position = stop
+        return view
+
+    def readinto(self, buffer):
+        view = self.read(len(buffer))
+        buffer[:len(view)] = view
+        return len(view)
+
+
+class ArchiveWriter:
+    """
+    Write the MIDI files of many songs into one uncompressed tar or zip archive.
+
+    Songs are appended to the archive sequentially. On close, an index of the songs is
+    written to '<path>.index.json' with the name, byte offset and size of the MIDI data
+    within the archive and the seed, generation args and collapsed note counts (see 
+    EventTable.collapse_notes) of each song, so that a song can be read back with a 
+    single seek (see ArchiveReader).
+    """
+    def __init__(self, path, format='tar'):
+        assert format in archive_formats, f'format must be one of {archive_formats}'
+        self.path = path
+        self.format = format
+        if format == 'tar':
+            self.archive = tarfile.open(path, 'w', format=tarfile.PAX_FORMAT)
+        else:
+            self.archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        self.songs = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, name, data, seed=None, args=None, collapsed=None):
+        """
+        Append the MIDI data (bytes-like) of one song as a member called name. The data 
+        is written to the archive from the given buffer without intermediate copies.
+        """
+        data = memoryview(data)
+        size = data.nbytes
+        if self.format == 'tar':
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = size
+            self.archive.addfile(tarinfo, BufferReader(data))
+            # The data ends at the current offset, padded to a whole tar block
+            padded_size = -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            offset = self.archive.offset - padded_size
+        else:
+            # Same member attributes as ZipFile.writestr
+            zipinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+            zipinfo.compress_type = zipfile.ZIP_STORED
+            zipinfo.external_attr = 0o600 << 16
+            zipinfo.file_size = size
+            with self.archive.open(zipinfo, 'w') as member:
+                member.write(data)
+            offset = self.archive.fp.tell() - size
+        self.songs.append({'name': name, 'offset': offset, 'size': size, 'seed': seed, 'args': args,
+                           'collapsed': collapsed})
+
+    def write_song(self, plan, seed, name=None):
+        """
+        Generate a song from a GenerationPlan and append it as '<seed>.mid' or name.
+        """
+        midi_bytes = io.BytesIO()
+        event_table = plan.execute(seed, filepath=midi_bytes)
+        name = name if name is not None else f'{seed}.mid'
+        self.append(name, midi_bytes.getbuffer(), seed, event_table.args, event_table.collapsed)
+
+    def close(self):
+        """
+        Close the archive and write the index file.
+        """
+        if self.closed:
+            return
+        self.archive.close()
+        self.closed = True
+        with open(self.path + '.index.json', 'w') as index_file:
+            json.dump({'format': self.format, 'songs': self.songs}, index_file)
+
+
+class ArchiveReader:
+    """
+    Read songs from an archive written by ArchiveWriter using its index file.
+
+    reader[i] or reader[name] returns the MIDI bytes of a song by seeking directly to
+    its data, without scanning the archive.
+    """
+    def __init__(self, path):
+        with open(path + '.index.json') as index_file:
+            index = json.load(index_file)
+        self.format = index['format']
+        self.songs = index['songs']
+        self.names = {song['name']: i for i, song in enumerate(self.songs)}
+        self.archive_file = open(path, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __getitem__(self, i):
+        song = self.songs[self.names[i] if isinstance(i, str) else i]
+        self.archive_file.seek(song['offset'])
+        return self.archive_file.read(song['size'])
+
+    def close(self):
+        self.archive_file.close()
+
+
+def generate_archive(path, seeds, arg_str_list=[], format='tar', processes=None, pattern_bank=None,
+                     progressions=None):
+    """
+    Generate one song per seed with otherwise the same arguments and write the MIDI files
+    of all songs to one archive at path (see ArchiveWriter). If processes is given, the
+    songs are generated in that many worker processes (see parallel.generate_shared). If
+    pattern_bank (a PatternBank) is given, the songs sample their initialized patterns
+    from it; each worker process uses its own copy. Likewise for progressions (a 
+    ProgressionSampler) and the chord progressions.
+    """
+    plan = GenerationPlan(arg_str_list, pattern_bank=pattern_bank, progressions=progressions)
+    with ArchiveWriter(path, format) as writer:
+        if processes is None:
+            for seed in seeds:
+                writer.write_song(plan, seed)
+        else:
+            for result in generate_shared(plan, seeds, processes, payload='midi'):
+                writer.append(f'{result.seed}.mid', result.open(), result.seed, result.args, result.collapsed)
+                result.release()
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import socket
+import multiprocessing
+
+from music.archive import ArchiveWriter
+from music.create_midi import GenerationPlan, validate_args
+from music.metrics import registry
+
+
+def shard_name(shard):
+    return f'shard-{shard:06d}'
+
+
+def create_manifest(directory, jobs, shard_size=100):
+    """
+    Create a batch directory with a manifest of jobs, each a (seed, arg_str_list) pair.
+
+    The jobs are split into deterministic shards of shard_size consecutive jobs; shard i
+    is jobs[i*shard_size:(i+1)*shard_size]. Workers on any number of nodes sharing the
+    directory claim and run shards with work(). The arguments of every job are validated 
+    first, and ValueError is raised for invalid arguments.
+    """
+    validated = set()
+    for job_idx, (seed, arg_str_list) in enumerate(jobs):
+        if tuple(arg_str_list) in validated:
+            continue
+        try:
+            validate_args(list(arg_str_list))
+        except SystemExit:
+            # argparse exits on invalid arguments
+            raise ValueError(f'invalid arguments for job {job_idx}: {arg_str_list}') from None
+        validated.add(tuple(arg_str_list))
+    for subdirectory in ['claims', 'done', 'failed', 'output']:
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+    manifest = {
+        'shard_size': shard_size,
+        'jobs': [{'seed': str(seed), 'args': list(arg_str_list)} for seed, arg_str_list in jobs]
+    }
+    write_atomic(os.path.join(directory, 'manifest.json'), json.dumps(manifest))
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+        return json.load(manifest_file)
+
+
+def num_shards(manifest):
+    return -(-len(manifest['jobs']) // manifest['shard_size'])
+
+
+def shard_jobs(manifest, shard):
+    """
+    (job index, job) of each job in shard.
+    """
+    first = shard * manifest['shard_size']
+    jobs = manifest['jobs'][first:first + manifest['shard_size']]
+    return list(enumerate(jobs, start=first))
+
+
+def write_atomic(path, text):
+    """
+    Write text to path through a temporary file and a rename, so that readers on any
+    node see either the old or the complete new file.
+    """
+    tmp_path = f'{path}.tmp-{socket.gethostname()}-{os.getpid()}'
+    with open(tmp_path, 'w') as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_path, path)
+
+
+def claim_file(directory, shard, epoch):
+    return os.path.join(directory, 'claims', f'{shard_name(shard)}.{epoch}')
+
+
+def latest_claim(directory, shard):
+    """
+    (epoch, age in seconds) of the latest claim of a shard, or (-1, None) if the shard
+    was never claimed.
+    """
+    epoch = -1
+    while os.path.exists(claim_file(directory, shard, epoch + 1)):
+        epoch += 1
+    if epoch < 0:
+        return epoch, None
+    return epoch, time.time() - os.path.getmtime(claim_file(directory, shard, epoch))
+
+
+def read_record(directory, subdirectory, shard):
+    """
+    The done or failed record of a shard, or None.
+    """
+    path = os.path.join(directory, subdirectory, shard_name(shard) + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as record_file:
+        return json.load(record_file)
+
+
+def claim_shard(directory, shard, stale_after=600):
+    """
+    Try to claim a shard for this process. Returns the path of the claim file, or None
+    if the shard is done or claimed by a live worker.
+
+    Claims are numbered files 'claims/<shard>.<epoch>' created with O_EXCL, and the 
+    claim with the highest epoch holds the shard. A shard is claimed by creating the 
+    file of the next epoch, which succeeds for exactly one worker, and only if the latest 
+    claim is stale: not touched for stale_after seconds (its worker died) or released. 
+    Claim files are never removed, so each worker only ever touches its own claim.
+    """
+    if read_record(directory, 'done', shard) is not None:
+        return None
+    epoch, age = latest_claim(directory, shard)
+    if age is not None and age < stale_after:
+        return None
+    path = claim_file(directory, shard, epoch + 1)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    with os.fdopen(fd, 'w') as claim:
+        claim.write(f'{socket.gethostname()}-{os.getpid()}')
+    return path
+
+
+def release_claim(path):
+    """
+    Release a claim by marking it stale, so that any worker can claim the shard again.
+    """
+    os.utime(path, (0, 0))
+
+
+def run_shard(directory, manifest, shard, claim_path=None, max_attempts=3, pattern_bank=None,
+              progressions=None):
+    """
+    Generate the songs of a shard into 'output/<shard>.<attempt>.tar' (see ArchiveWriter)
+    and record the result in 'done/<shard>.json'. A job that raises (or exits) is recorded 
+    as a failure and the other jobs still run. The archive only replaces the final file 
+    when it is complete, and the record is written last, so an interrupted attempt is 
+    simply run again.
+
+    A shard with failed jobs is recorded in 'failed/<shard>.json' instead and its claim 
+    is released, so that it is run again, until max_attempts attempts have failed; the 
+    last attempt is recorded as done with its failures. A retry only runs the jobs that 
+    failed: the records list the archives of all attempts and the jobs completed in any 
+    of them. If pattern_bank (a PatternBank) is given, the songs sample their initialized 
+    patterns from it, and if progressions (a ProgressionSampler) is given, their chord
+    progressions.
+    """
+    name = shard_name(shard)
+    previous = read_record(directory, 'failed', shard)
+    attempt = previous['attempt'] + 1 if previous is not None else 1
+    archives = previous['archives'] if previous is not None else []
+    completed = previous['completed'] if previous is not None else []
+    archive_path = os.path.join(directory, 'output', f'{name}.{attempt}.tar')
+    tmp_path = f'{archive_path}.tmp-{socket.gethostname()}-{os.getpid()}'
+    skipped = set(completed)
+    plans = {}
+    failures = []
+    try:
+        with ArchiveWriter(tmp_path) as writer:
+            for job_idx, job in shard_jobs(manifest, shard):
+                if job_idx in skipped:
+                    continue
+                try:
+                    key = tuple(job['args'])
+                    if key not in plans:
+                        plans[key] = GenerationPlan(job['args'], pattern_bank=pattern_bank, progressions=progressions)
+                    writer.write_song(plans[key], job['seed'], name=f'{job_idx:08d}-{job["seed"]}.mid')
+                    completed.append(job_idx)
+                except (Exception, SystemExit) as error:
+                    failures.append({'job': job_idx, 'seed': job['seed'], 'error': repr(error)})
+                if claim_path is not None:
+                    # Heartbeat: keep the claim from going stale while the shard runs
+                    os.utime(claim_path)
+    except BaseException:
+        for path in [tmp_path, tmp_path + '.index.json']:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    os.replace(tmp_path + '.index.json', archive_path + '.index.json')
+    os.replace(tmp_path, archive_path)
+    record = {'shard': shard, 'archives': archives + [os.path.relpath(archive_path, directory)],
+              'attempt': attempt, 'completed': sorted(completed), 'failures': failures}
+    if failures and attempt < max_attempts:
+        write_atomic(os.path.join(directory, 'failed', name + '.json'), json.dumps(record))
+        if claim_path is not None:
+            release_claim(claim_path)
+        return record
+    write_atomic(os.path.join(directory, 'done', name + '.json'), json.dumps(record))
+    return record
+
+
+def worker(directory, stale_after=600, max_attempts=3, pattern_bank=None, progressions=None):
+    """
+    Claim and run shards until every shard is done or claimed by a live worker. Workers
+    start at different shards to avoid contending for the same claims. A shard whose 
+    jobs failed is released (see run_shard) and claimed again by a later pass, so the 
+    worker keeps passing over the shards until a pass finds none to claim; the number 
+    of passes is bounded by max_attempts. The shards share pattern_bank and progressions 
+    if given.
+    Returns the number of shard attempts run.
+    """
+    manifest = load_manifest(directory)
+    shards = num_shards(manifest)
+    start = hash((socket.gethostname(), os.getpid())) % max(shards, 1)
+    shards_run = 0
+    while True:
+        pass_run = 0
+        for i in range(shards):
+            shard = (start + i) % shards
+            claim_path = claim_shard(directory, shard, stale_after)
+            if claim_path is None:
+                continue
+            run_shard(directory, manifest, shard, claim_path, max_attempts, pattern_bank, progressions)
+            pass_run += 1
+        shards_run += pass_run
+        if pass_run == 0:
+            return shards_run
+
+
+def _pool_worker(directory, stale_after, max_attempts, pattern_bank, progressions):
+    """
+    worker() in a pool process: returns the number of shards run and the metrics 
+    recorded meanwhile (see Registry.drain).
+    """
+    return worker(directory, stale_after, max_attempts, pattern_bank, progressions), registry.drain()
+
+
+def work(directory, processes=None, stale_after=600, max_attempts=3, pattern_bank=None, progressions=None):
+    """
+    Run worker() in processes processes (default: one per core) on this node. Run
+    work() on every node that shares the directory to scale across nodes. The metrics 
+    recorded by the workers are merged into the registry of this process. Each process
+    uses its own copy of pattern_bank and progressions if given.
+    """
+    processes = processes if processes is not None else os.cpu_count()
+    with multiprocessing.Pool(processes, initializer=registry.reset) as pool:
+        results = pool.starmap(_pool_worker, [(directory, stale_after, max_attempts, pattern_bank, progressions)] * processes)
+    for _, metrics in results:
+        registry.merge(metrics)
+    return sum(shards_run for shards_run, _ in results)
+
+
+def status(directory, stale_after=600):
+    """
+    Progress of a batch: numbers of shards done, claimed by live workers, waiting for a
+    retry after failed jobs and pending (including the retries), completed jobs (also
+    those of shards waiting for a retry) and the failures recorded in the done shards.
+    """
+    manifest = load_manifest(directory)
+    done, claimed, retrying, completed, failures = 0, 0, 0, 0, []
+    for shard in range(num_shards(manifest)):
+        record = read_record(directory, 'done', shard)
+        if record is not None:
+            done += 1
+            completed += len(record['completed'])
+            failures += record['failures']
+            continue
+        _, age = latest_claim(directory, shard)
+        previous = read_record(directory, 'failed', shard)
+        if previous is not None:
+            completed += len(previous['completed'])
+        if age is not None and age < stale_after:
+            claimed += 1
+        elif previous is not None:
+            retrying += 1
+    return {
+        'shards': num_shards(manifest),
+        'done': done,
+        'claimed': claimed,
+        'retrying': retrying,
+        'pending': num_shards(manifest) - done - claimed,
+        'completed_jobs': completed,
+        'failures': failures
+    }
+
+
+if __name__ == "__main__":
+
+    # python -m music.batch work <directory> [processes] | status <directory>
+    command, directory = sys.argv[1], sys.argv[2]
+    if command == 'work':
+        work(directory, int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    print(json.dumps(status(directory), indent=1))
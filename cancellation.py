@@ -0,0 +1,34 @@
+import time
+import threading
+
+
+class Cancelled(Exception):
+    """
+    Raised by the generators when their CancellationToken is cancelled.
+    """
+    pass
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation for run(). The token counts as cancelled once cancel() has
+    been called (from any thread) or the optional deadline has passed.
+
+    Attributes:
+        deadline: float     time.monotonic() value after which the token is cancelled, or None.
+    """
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Cancel generation at the next check.
+        """
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        if self._cancel_event.is_set():
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
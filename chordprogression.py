@@ -1,6 +1,7 @@
 import random
 import warnings
 from music.patterns import Scale
+from music.pitchset import PitchSet
 
 
 class ChordProgression:
@@ -83,11 +84,11 @@ class ChordProgression:
             for octave in range(8):
                 all_chord_idxs.extend([note + self.scale_length*octave for note in current_voicing])
 
-            scale_idxs = range(len(scale.all_scale_notes))
             scale_degree_note = (scale.key + scale.mode[scale_degree]) % 12
-            scale_degree_first_idx = [x % 12 for x in scale.all_scale_notes].index(scale_degree_note)
-            offset_idxs = [i - scale_degree_first_idx for i in scale_idxs]
-            offset_chord_idxs = [offset_idxs.index(note) for note in all_chord_idxs if note in offset_idxs]
+            scale_degree_first_note = (scale.pitch_set & PitchSet.from_pitch_classes([scale_degree_note])).lowest()
+            scale_degree_first_idx = scale.pitch_set.rank(scale_degree_first_note)
+            offset_chord_idxs = [note + scale_degree_first_idx for note in all_chord_idxs 
+                                 if note + scale_degree_first_idx < len(scale.all_scale_notes)]
 
             all_chord_notes = []
             for i, idx in enumerate(offset_chord_idxs):
@@ -170,11 +171,11 @@ def generate_chord_progression(scale, length=8, voicing=None, allow_outside=None
         for octave in range(8):
             all_chord_idxs.extend([note + scale_length*octave for note in voicing])
 
-        scale_idxs = range(len(scale.all_scale_notes))
         scale_degree_note = (scale.key + scale.mode[scale_degree]) % 12
-        scale_degree_first_idx = [x % 12 for x in scale.all_scale_notes].index(scale_degree_note)
-        offset_idxs = [i - scale_degree_first_idx for i in scale_idxs]
-        offset_chord_idxs = [offset_idxs.index(note) for note in all_chord_idxs if note in offset_idxs]
+        scale_degree_first_note = (scale.pitch_set & PitchSet.from_pitch_classes([scale_degree_note])).lowest()
+        scale_degree_first_idx = scale.pitch_set.rank(scale_degree_first_note)
+        offset_chord_idxs = [note + scale_degree_first_idx for note in all_chord_idxs 
+                             if note + scale_degree_first_idx < len(scale.all_scale_notes)]
 
         all_chord_notes = []
         for i, idx in enumerate(offset_chord_idxs):
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import warnings
+
+import numpy as np
+
+from music.create_midi import run
+from music.metrics import phase_seconds
+
+
+# Size parameters swept on a log grid, each with the gentype it is measured on
+default_sweeps = {
+    'length': (4, [4, 8, 16, 32, 64]),
+    'repeat': (1, [1, 2, 4, 8, 16, 32]),
+    'numpatterns': (3, [2, 4, 8, 16, 32, 64]),
+    'numtracks': (3, [2, 4, 8, 16])
+}
+
+default_seeds = [1, 2, 3]
+
+# Allowed growth of an exponent over the recorded one before check fails
+default_margin = 0.25
+
+# Sweeps recorded for the thresholds; the largest exponent of each phase is kept, since
+# the exponents of the short phases vary between runs
+record_rounds = 5
+
+# Thresholds of the last recording, written by running this module with 'record'
+thresholds_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'complexity_thresholds.json')
+
+
+def phase_totals():
+    """
+    Total seconds recorded in the phase_seconds metric so far, per phase (pattern
+    classes merged, e.g. 'initialize:Bass' counts as 'initialize').
+    """
+    totals = {}
+    for (name,), total in phase_seconds.sums().items():
+        phase = name.split(':')[0]
+        totals[phase] = totals.get(phase, 0.0) + total
+    return totals
+
+
+def measure(arg_str_list, seeds=default_seeds):
+    """
+    Median seconds of run(arg_str_list) over seeds, in total and per phase.
+    """
+    samples = []
+    for seed in seeds:
+        before = phase_totals()
+        start_time = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            run(arg_str_list + ['--seed', str(seed)], os.devnull)
+        seconds = {'total': time.perf_counter() - start_time}
+        for phase, total in phase_totals().items():
+            seconds[phase] = total - before.get(phase, 0.0)
+        samples.append(seconds)
+    phases = sorted(set().union(*samples))
+    return {phase: float(np.median([x.get(phase, 0.0) for x in samples])) for phase in phases}
+
+
+def fit_exponent(values, seconds):
+    """
+    Empirical complexity exponent: slope of log(seconds) against log(values) fitted by
+    least squares, so that seconds ~ values ** exponent.
+    """
+    values, seconds = np.asarray(values, dtype=float), np.asarray(seconds, dtype=float)
+    valid = seconds > 0
+    if valid.sum() < 2:
+        return 0.0
+    slope, _ = np.polyfit(np.log(values[valid]), np.log(seconds[valid]), 1)
+    return float(slope)
+
+
+def sweep(sweeps=default_sweeps, seeds=default_seeds):
+    """
+    Run each sweep and fit the exponent of each phase. Returns a dict
+    {param: {'values', 'seconds': {phase: [...]}, 'exponents': {phase: exponent}}}.
+    """
+    results = {}
+    for param, (gentype, values) in sweeps.items():
+        measurements = [measure(['--gentype', str(gentype), '--' + param, str(x)], seeds) for x in values]
+        phases = sorted(set().union(*measurements))
+        seconds = {phase: [x.get(phase, 0.0) for x in measurements] for phase in phases}
+        exponents = {phase: fit_exponent(values, seconds[phase]) for phase in phases}
+        results[param] = {'values': values, 'seconds': seconds, 'exponents': exponents}
+    return results
+
+
+def thresholds_from(results, margin=default_margin):
+    """
+    Thresholds allowing each recorded exponent to grow by margin.
+    """
+    return {param: {phase: exponent + margin for phase, exponent in result['exponents'].items()}
+            for param, result in results.items()}
+
+
+def merge_thresholds(*thresholds):
+    """
+    Largest threshold of each param and phase over several recordings.
+    """
+    merged = {}
+    for recording in thresholds:
+        for param, phases in recording.items():
+            for phase, threshold in phases.items():
+                merged.setdefault(param, {})[phase] = max(threshold, merged.get(param, {}).get(phase, threshold))
+    return merged
+
+
+def load_thresholds(path=thresholds_path):
+    """
+    Thresholds saved at path (see save_thresholds).
+    """
+    with open(path) as thresholds_file:
+        return json.load(thresholds_file)
+
+
+def save_thresholds(thresholds, path=thresholds_path):
+    """
+    Save thresholds to path (read by load_thresholds).
+    """
+    with open(path, 'w') as thresholds_file:
+        json.dump(thresholds, thresholds_file, indent=1)
+
+
+def check(results, thresholds=None):
+    """
+    List of (param, phase, exponent, threshold) of the exponents above their threshold.
+    Phases without a stored threshold are not checked. The default thresholds are the 
+    recorded ones (load_thresholds()).
+    """
+    thresholds = thresholds if thresholds is not None else load_thresholds()
+    failures = []
+    for param, result in results.items():
+        for phase, exponent in result['exponents'].items():
+            threshold = thresholds.get(param, {}).get(phase)
+            if threshold is not None and exponent > threshold:
+                failures.append((param, phase, exponent, threshold))
+    return failures
+
+
+def report(results, thresholds=None):
+    """
+    Format the fitted exponents (and thresholds, if given) as a text table.
+    """
+    lines = [f'{"param":12} {"phase":12} {"exponent":>9} {"threshold":>10}  seconds']
+    for param, result in results.items():
+        for phase, exponent in result['exponents'].items():
+            threshold = (thresholds or {}).get(param, {}).get(phase)
+            threshold_str = f'{threshold:10.2f}' if threshold is not None else f'{"-":>10}'
+            seconds_str = ' '.join(f'{x:.4f}' for x in result['seconds'][phase])
+            lines.append(f'{param:12} {phase:12} {exponent:9.2f} {threshold_str}  {seconds_str}')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    # python -m music.complexity record|check [thresholds.json] (default: thresholds_path)
+    command = sys.argv[1]
+    path = sys.argv[2] if len(sys.argv) > 2 else thresholds_path
+    results = sweep()
+    if command == 'record':
+        thresholds = merge_thresholds(thresholds_from(results),
+                                      *[thresholds_from(sweep()) for _ in range(record_rounds - 1)])
+        save_thresholds(thresholds, path)
+        print(report(results, thresholds))
+    else:
+        thresholds = load_thresholds(path)
+        print(report(results, thresholds))
+        failures = check(results, thresholds)
+        for param, phase, exponent, threshold in failures:
+            print(f'FAIL {param} {phase}: exponent {exponent:.2f} > {threshold:.2f}')
+        sys.exit(1 if failures else 0)
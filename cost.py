@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import random
+import tracemalloc
+from functools import lru_cache
+from collections import namedtuple
+
+import numpy as np
+from numpy import exp
+
+from music.create_midi import parse_args, run
+from music.patterns import (
+    Bass, SimpleBass, SimpleBass2, SimpleBass3, Harmonic, Arpeggio, LowMelodic,
+    MidMelodic, HighMelodic, PercussionSingle, BassDrum, Snare, Cymbals, AccentCymbals
+)
+
+
+CostEstimate = namedtuple('CostEstimate', ['events', 'patterns', 'memory', 'seconds'])
+
+# Coefficients of the last calibration, written by running this module
+calibration_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cost_calibration.json')
+
+bass_pattern_types = [Bass, SimpleBass, SimpleBass2, SimpleBass3]
+melody_pattern_types = [LowMelodic, MidMelodic, HighMelodic]
+percussion_pattern_types = [PercussionSingle, BassDrum, Snare, Cymbals, AccentCymbals]
+
+
+def normalize_args(arg_str_list):
+    """
+    Parse and normalize arguments as run() does, leaving the global random state untouched.
+    """
+    random_state = random.getstate()
+    try:
+        return parse_args(arg_str_list)
+    finally:
+        random.setstate(random_state)
+
+
+def expected_notes(pattern_type, length, repeat):
+    """
+    Expected number of notes of an initialized pattern with the given length and repeat.
+    """
+    if pattern_type in [Bass, SimpleBass3]:
+        weights = exp(-np.arange(1, length + 1))
+        note_amount = (np.arange(1, length + 1) * weights).sum() / weights.sum()
+    elif pattern_type in [SimpleBass, SimpleBass2]:
+        note_amount = 1
+    elif pattern_type == Harmonic:
+        note_amount = 4.5
+    elif pattern_type == Arpeggio:
+        note_amount = length
+    elif pattern_type in melody_pattern_types + [PercussionSingle, Cymbals]:
+        note_amount = (length + 1) / 2
+    elif pattern_type == BassDrum:
+        note_amount = (length // 2 + 1) / 2
+    elif pattern_type == Snare:
+        note_amount = (max(1, length // 3) + 1) / 2
+    elif pattern_type == AccentCymbals:
+        return 1
+    return note_amount * repeat
+
+
+def mean_notes(pattern_types, length, repeat):
+    """
+    Expected number of notes of a pattern type chosen at random from pattern_types.
+    """
+    return sum(expected_notes(x, length, repeat) for x in pattern_types) / len(pattern_types)
+
+
+def count_events(args):
+    """
+    Expected number of note events and number of initialized patterns of a song
+    generated with the normalized args (see parse_args).
+    """
+    if args.gentype == 1:
+        tracks = percussion_pattern_types + [bass_pattern_types, Harmonic, melody_pattern_types, melody_pattern_types]
+        if args.arpeggio:
+            tracks.append(Arpeggio)
+        section_events = sum(mean_notes(x if isinstance(x, list) else [x], args.length, args.repeat) for x in tracks)
+        return section_events * args.numpatterns, len(tracks)
+
+    elif args.gentype == 2:
+        num_tracks = min(args.numtracks, 3)
+        chord_events = num_tracks * mean_notes([Bass, Harmonic, Arpeggio], args.length, args.repeat)
+        return chord_events * args.chordproglen, num_tracks * args.chordproglen
+
+    elif args.gentype == 3:
+        # Track 0 is the bass and track 1 the bass drum. The other tracks are chosen at random
+        # and removed from the available patterns, except PercussionSingle and Cymbals.
+        num_tracks = 9 if args.allpatterns else args.numtracks
+        notes = {
+            'melody': mean_notes(melody_pattern_types, args.length, args.repeat),
+            'bass': mean_notes(bass_pattern_types, args.length, args.repeat)
+        }
+        for pattern_type in [Harmonic, PercussionSingle, Snare, Cymbals, AccentCymbals]:
+            notes[pattern_type] = expected_notes(pattern_type, args.length, args.repeat)
+        kept = (PercussionSingle, Cymbals)
+        removable = ('melody', 'melody', Harmonic, Snare, AccentCymbals)
+
+        @lru_cache(maxsize=None)
+        def random_tracks_notes(removable, tracks_left):
+            if tracks_left <= 0:
+                return 0
+            choices = removable + kept
+            total = 0
+            for i, choice in enumerate(choices):
+                rest = removable[:i] + removable[i+1:] if choice not in kept else removable
+                total += notes[choice] + random_tracks_notes(rest, tracks_left - 1)
+            return total / len(choices)
+
+        if args.allpatterns:
+            section_events = notes['bass'] + expected_notes(BassDrum, args.length, args.repeat) + sum(notes[x] for x in removable + kept)
+        else:
+            section_events = (notes['bass']
+                              + (expected_notes(BassDrum, args.length, args.repeat) if num_tracks > 1 else 0)
+                              + random_tracks_notes(removable, num_tracks - 2))
+        return section_events * args.numpatterns, num_tracks
+
+    elif args.gentype == 4:
+        bars = args.chordproglen * 4
+        bar_events = (expected_notes(SimpleBass, args.length, 1)
+                      + 3 * expected_notes(Harmonic, args.length, 1)
+                      + expected_notes(MidMelodic, args.length, 1))
+        drum_events = sum(expected_notes(x, 2 * args.length, bars // 2) for x in percussion_pattern_types)
+        return bar_events * bars + drum_events, 5 * bars + 5
+
+
+class Budget:
+    """
+    Upper limits for the estimated cost of a job. Limits that are None are not checked.
+    """
+    def __init__(self, max_events=None, max_memory=None, max_seconds=None):
+        self.max_events = max_events
+        self.max_memory = max_memory
+        self.max_seconds = max_seconds
+
+    def fits(self, estimate):
+        """
+        Whether a CostEstimate is within all limits.
+        """
+        limits = [
+            (self.max_events, estimate.events),
+            (self.max_memory, estimate.memory),
+            (self.max_seconds, estimate.seconds)
+        ]
+        return all(limit is None or value <= limit for limit, value in limits)
+
+    def excess(self, estimate):
+        """
+        Largest ratio of an estimated cost to its limit (0 if no limit is set).
+        """
+        limits = [
+            (self.max_events, estimate.events),
+            (self.max_memory, estimate.memory),
+            (self.max_seconds, estimate.seconds)
+        ]
+        return max([value / limit for limit, value in limits if limit is not None], default=0)
+
+
+class CostModel:
+    """
+    Linear cost model for run(). Predicts the number of note events from the normalized
+    args and gentype, memory as bytes per event and runtime from the number of events
+    and initialized patterns. Coefficients can be refitted with calibrate and are stored
+    in calibration_path by running this module (see load).
+    """
+    def __init__(self, bytes_per_event=680, seconds_per_event=1.2e-4, seconds_per_pattern=6e-3):
+        self.bytes_per_event = bytes_per_event
+        self.seconds_per_event = seconds_per_event
+        self.seconds_per_pattern = seconds_per_pattern
+
+    @classmethod
+    def load(cls, path=calibration_path):
+        """
+        Cost model with the coefficients saved at path, or the default coefficients if 
+        the model has not been calibrated.
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as calibration_file:
+            return cls(**json.load(calibration_file))
+
+    def save(self, path=calibration_path):
+        """
+        Save the coefficients to path (read by load).
+        """
+        coefficients = {
+            'bytes_per_event': self.bytes_per_event,
+            'seconds_per_event': self.seconds_per_event,
+            'seconds_per_pattern': self.seconds_per_pattern
+        }
+        with open(path, 'w') as calibration_file:
+            json.dump(coefficients, calibration_file, indent=1)
+
+    def estimate(self, arg_str_list=[]):
+        """
+        Estimate the cost of run(arg_str_list) without generating anything. The global
+        random state is left untouched.
+        """
+        return self.estimate_args(normalize_args(arg_str_list))
+
+    def estimate_args(self, args):
+        """
+        Estimate the cost of generating a song with already normalized args.
+        """
+        events, patterns = count_events(args)
+        memory = self.bytes_per_event * events
+        seconds = self.seconds_per_event * events + self.seconds_per_pattern * patterns
+        return CostEstimate(int(events), int(patterns), int(memory), float(seconds))
+
+    @classmethod
+    def calibrate(cls, arg_str_lists, filepath=os.devnull):
+        """
+        Fit a cost model to measured runs of run(arg_str_list, filepath) for each
+        arg_str_list. Runtime is fitted by least squares on (events, patterns) and memory
+        as the mean peak traced allocation per actual event.
+        """
+        counts, seconds, bytes_per_event = [], [], []
+        for arg_str_list in arg_str_lists:
+            args = normalize_args(arg_str_list)
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            event_table = run(arg_str_list, filepath)
+            seconds.append(time.perf_counter() - start_time)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            counts.append(count_events(args))
+            bytes_per_event.append(peak / max(len(event_table), 1))
+
+        coefs, *_ = np.linalg.lstsq(np.array(counts, dtype=float), np.array(seconds), rcond=None)
+        return cls(bytes_per_event=float(np.mean(bytes_per_event)),
+                   seconds_per_event=max(float(coefs[0]), 0.0),
+                   seconds_per_pattern=max(float(coefs[1]), 0.0))
+
+
+# Parameters that drive the cost of each gentype (see count_events), with their minimum values
+downscale_params = {
+    1: [('repeat', 1), ('numpatterns', 1), ('length', 2)],
+    2: [('repeat', 1), ('chordproglen', 1), ('numtracks', 1), ('length', 2)],
+    3: [('repeat', 1), ('numpatterns', 1), ('numtracks', 2), ('length', 2)],
+    4: [('chordproglen', 1), ('length', 2)]
+}
+
+
+def downscale_args(args, budget, model):
+    """
+    Halve the cost parameters of args (see downscale_params) in place until the estimated 
+    cost fits budget. Each step halves the parameter that reduces the estimate the most 
+    relative to the budget; parameters whose halving does not reduce it are left alone. 
+    Returns (names of the reduced parameters, estimate).
+    """
+    estimate = model.estimate_args(args)
+    reduced = []
+    while not budget.fits(estimate):
+        best = None
+        for name, min_value in downscale_params[args.gentype]:
+            value = getattr(args, name)
+            if value <= min_value:
+                continue
+            setattr(args, name, max(min_value, value // 2))
+            candidate = model.estimate_args(args)
+            setattr(args, name, value)
+            if budget.excess(candidate) < budget.excess(best[1] if best is not None else estimate):
+                best = (name, candidate)
+        if best is None:
+            break
+        name, estimate = best
+        setattr(args, name, max(dict(downscale_params[args.gentype])[name], getattr(args, name) // 2))
+        if name not in reduced:
+            reduced.append(name)
+    return reduced, estimate
+
+
+def admit(arg_str_list, budget, slow_budget=None, downscale=False, model=None):
+    """
+    Admission control for run() arguments.
+
+    Returns (decision, arg_str_list, estimate). The decision is 'run' if the estimated
+    cost fits budget, 'slow' if it only fits slow_budget (route the job to a slow queue)
+    and 'reject' otherwise. With downscale, a job that fits neither budget has the 
+    parameters that drive the cost of its gentype halved, the costliest first, until it 
+    fits budget (see downscale_args); the returned arg_str_list then overrides the reduced 
+    values. Invalid arguments are rejected with an estimate of None. The default model 
+    is CostModel.load().
+    """
+    model = model if model is not None else CostModel.load()
+    try:
+        args = normalize_args(arg_str_list)
+    except SystemExit:
+        # argparse exits on invalid arguments
+        return 'reject', arg_str_list, None
+    estimate = model.estimate_args(args)
+    if budget.fits(estimate):
+        return 'run', arg_str_list, estimate
+    if slow_budget is not None and slow_budget.fits(estimate):
+        return 'slow', arg_str_list, estimate
+    if not downscale:
+        return 'reject', arg_str_list, estimate
+
+    reduced, estimate = downscale_args(args, budget, model)
+    if not budget.fits(estimate):
+        return 'reject', arg_str_list, estimate
+    overrides = []
+    for name in reduced:
+        overrides += ['--' + name, str(getattr(args, name))]
+    return 'run', arg_str_list + overrides, estimate
+
+
+class JobRejected(Exception):
+    """
+    Raised by AdmissionControl.check for a job rejected by admission control.
+    """
+    pass
+
+
+class AdmissionControl:
+    """
+    Budgets for admitting jobs (see admit). Pass an AdmissionControl to run() or 
+    GenerationPlan to check the arguments before anything is generated.
+
+    Attributes:
+        budget: Budget          Limits of jobs that run directly.
+        slow_budget: Budget     Limits of jobs routed to a slow queue, or None.
+        downscale: bool         Whether jobs over both budgets are downscaled instead of rejected.
+        model: CostModel        Cost model (default CostModel.load()).
+    """
+    def __init__(self, budget, slow_budget=None, downscale=False, model=None):
+        self.budget = budget
+        self.slow_budget = slow_budget
+        self.downscale = downscale
+        self.model = model if model is not None else CostModel.load()
+
+    def admit(self, arg_str_list):
+        """
+        (decision, arg_str_list, estimate) of a job, see admit.
+        """
+        return admit(arg_str_list, self.budget, self.slow_budget, self.downscale, self.model)
+
+    def check(self, arg_str_list):
+        """
+        As admit, but raises JobRejected for rejected jobs.
+        """
+        decision, arg_str_list, estimate = self.admit(arg_str_list)
+        if decision == 'reject':
+            if estimate is None:
+                raise JobRejected(f'invalid arguments: {arg_str_list}')
+            raise JobRejected(f'estimated cost {estimate} exceeds the budget')
+        return decision, arg_str_list, estimate
+
+
+if __name__ == "__main__":
+
+    # Refit the cost model on a small benchmark grid, save and report the fitted coefficients
+    calibration_grid = [
+        ['--seed', str(seed), '--gentype', str(gentype), '--length', str(length), '--repeat', str(repeat)]
+        for seed in range(2) for gentype in [1, 3, 4] for length in [4, 16] for repeat in [1, 8]
+    ]
+    model = CostModel.calibrate(calibration_grid)
+    model.save()
+    print(f'bytes_per_event={model.bytes_per_event:.0f}, '
+          f'seconds_per_event={model.seconds_per_event:.2e}, '
+          f'seconds_per_pattern={model.seconds_per_pattern:.2e}')
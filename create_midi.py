@@ -1,26 +1,37 @@
 import os
 import sys
+import copy
+import time
 import random
 import argparse
-from itertools import groupby
-
-from midiutil import MIDIFile
+import numpy as np
+from itertools import groupby, accumulate
+from contextlib import contextmanager, nullcontext
+
+from music.encoders import encode
+from music.events import EventTable
+from music.cancellation import Cancelled
+from music.metrics import songs_generated, song_events, mutations, mutation_tries, phase_seconds, notes_collapsed
 from music.chordprogression import generate_chord_progression
 from music.patterns import (
     Scale, Pattern, Bass, SimpleBass, SimpleBass2, SimpleBass3, Harmonic, 
     Arpeggio, LowMelodic, MidMelodic, HighMelodic, PercussionSingle, BassDrum,
-    Snare, Cymbals, AccentCymbals, ChordProgression
+    Snare, Cymbals, AccentCymbals, ChordProgression, ScaleViews
 )
 
 
-def run(arg_str_list=[], filepath='midis/test.mid'):
-
-
-    #=====================================================================#
-    #                     Parse command line arguments                    #
-    #=====================================================================#
+# Allowed ranges when randomized (input 0)
+random_tempo_min = 60
+random_tempo_max = 300
+random_length_min = 3
+random_length_max = 32
+random_repeat_choices = list(range(2, 18, 2))
 
 
+def validate_args(arg_str_list=[]):
+    """
+    Parse and validate the arguments of run(). Randomized (0) values are left unresolved.
+    """
     parser = argparse.ArgumentParser(
         description='Create midi file of algorithmically generated music.'
     )
@@ -31,13 +42,6 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     repeat_range = range(1, 1000)
     pattern_range = range(1, 100)
 
-    # Allowed ranges when randomized (input 0)
-    random_tempo_min = 60
-    random_tempo_max = 300
-    random_length_min = 3
-    random_length_max = 32
-    random_repeat_choices = list(range(2, 18, 2))
-
     parser.add_argument('-s', '--seed', default=None, help='random seed', metavar='')
     parser.add_argument('-c', '--scale', default='major', choices=Scale.scale_types.keys(), help='scale type shared by patterns', metavar='')
     parser.add_argument('-m', '--mode', type=int, default=0, choices=range(12), help='mode index in range(12)', metavar='')
@@ -48,6 +52,7 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     parser.add_argument('-n', '--numtracks', type=int, default=16, choices=range(1, 21), help='number of tracks in range(1, 9)', metavar='')
     parser.add_argument('-p', '--numpatterns', type=int, default=16, help=f'number of patterns in {pattern_range}', metavar='')
     parser.add_argument('-v', '--voicing', type=str, default=None, choices=ChordProgression.basic_voicings.keys(), help=f'type of the chords in the chord progression', metavar='')
+    parser.add_argument('-vl', '--voiceleading', type=int, default=0, choices=[1,0], help=f'whether to realize the chords of the progression with minimal voice movement (gentype 4)', metavar='')
     parser.add_argument('-lt', '--limittracks', type=int, default=1, choices=[1,0], help=f'whether to limit number of tracks per pattern type', metavar='')
     parser.add_argument('-ar', '--arpeggio', type=int, default=1, choices=[1,0], help=f'whether to allow arpeggio pattern type', metavar='')
     parser.add_argument('-nc', '--nicescales', type=int, default=1, choices=[1,0], help=f'whether to use "nice" or "spicy" scales', metavar='')
@@ -55,26 +60,20 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     parser.add_argument('-gen', '--gentype', type=int, default=4, choices=[1,2,3,4], help=f'music generation type', metavar='')
     parser.add_argument('-all', '--allpatterns', type=int, default=0, choices=[1,0], help=f'whether to use all patterns in available_patterns', metavar='')
     parser.add_argument('-rig', '--rigidity', type=float, default=0.8, help=f'controls how strictly the drum patterns follow a basic backbeat', metavar='')
+    parser.add_argument('-norm', '--normalize', type=int, default=0, choices=[1,0], help=f'whether to merge duplicate notes and trim overlapping notes before writing', metavar='')
+    parser.add_argument('-addr', '--addressable', type=int, default=0, choices=[1,0], help=f'whether the randomness of each section is derived from the seed and section index (gentypes 1, 3)', metavar='')
 
 
     args = parser.parse_args(arg_str_list)
 
-    random.seed(args.seed)
-
     if args.length not in length_range:
         parser.error(f'length is not in {length_range}')
-    if args.length == 0:
-        args.length = random.randint(random_length_min, random_length_max)
 
     if args.repeat not in repeat_range:
         parser.error(f'repeat is not in {repeat_range}')
-    if args.repeat == 0:
-        args.repeat = random.choice(random_repeat_choices)
 
     if args.tempo not in tempo_range:
         parser.error(f'tempo is not in {tempo_range}')
-    if args.tempo == 0:
-        args.tempo = random.randint(random_tempo_min, random_tempo_max)
 
     if args.numpatterns not in pattern_range:
         parser.error(f'number of patterns is not in {pattern_range}')
@@ -93,17 +92,223 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     if args.allpatterns:
         args.numtracks = 16
 
+    return args
+
+
+def resolve_random_args(args):
+    """
+    Replace randomized (0) length, repeat and tempo in args with random values.
+    """
+    if args.length == 0:
+        args.length = random.randint(random_length_min, random_length_max)
+    if args.repeat == 0:
+        args.repeat = random.choice(random_repeat_choices)
+    if args.tempo == 0:
+        args.tempo = random.randint(random_tempo_min, random_tempo_max)
+
 
+def parse_args(arg_str_list=[]):
+    """
+    Parse and validate the arguments of run() and seed the random number generator 
+    with the given seed. Randomized (0) values are resolved in the returned args.
+    """
+    args = validate_args(arg_str_list)
+    random.seed(args.seed)
+    resolve_random_args(args)
+    return args
+
+
+class GenerationPlan:
+    """
+    Compiled arguments of run(). The arguments are parsed and validated once and the
+    tables that do not depend on the seed (instruments, pattern types, scales, mutation
+    weights) are resolved, so that execute(seed) only does the random work of generating
+    a song. A plan is not modified by execute and can be pickled, e.g. to share it
+    between the workers of a batch.
+
+    Attributes:
+        args: argparse.Namespace    Validated arguments, randomized (0) values unresolved.
+        scales: dict[int, Scale]    Scale for each possible key, or None if the scale type is random.
+        pattern_bank: PatternBank   If given, initialized patterns are sampled from this bank 
+                                    instead of being generated for every song.
+        progressions: ProgressionSampler  If given, the chord progressions of gentype 4 are drawn 
+                                    from its batch-sampled blocks instead of being sampled for 
+                                    every song.
+        decision: str               Admission decision ('run' or 'slow') if an admission control 
+                                    (cost.AdmissionControl) was given, else None. The plan is not 
+                                    created for rejected arguments (JobRejected is raised), and 
+                                    downscaled arguments replace the given ones.
+        estimate: CostEstimate      Estimated cost of a song if an admission control was given.
+    """
+
+    # Allowed instruments
+    all_instruments = (1,8,10,11,12,15,23,35,45,46,48,49,50,51,52,62,71,72,73,74,75,76,78,79,88,89,90,102,114)
+    bass_instruments = (0,33,35,48,49,50,51,62)
+    arp_instruments = (90,102)
+
+    # Patterns
+    all_pattern_types = (Bass, SimpleBass, SimpleBass2, SimpleBass3, Harmonic, Arpeggio, 
+                         LowMelodic, MidMelodic, HighMelodic, PercussionSingle, BassDrum, 
+                         Snare, Cymbals, AccentCymbals)
+    percussion_pattern_types = (PercussionSingle, BassDrum, Snare, Cymbals, AccentCymbals)
+    bass_pattern_types = (Bass, SimpleBass, SimpleBass2, SimpleBass3)
+    melody_pattern_types = (LowMelodic, MidMelodic, HighMelodic)
+
+    # Scales
+    nice_scale_types = ('major', 'pentatonic', 'major_no4', 'major_no7')
+
+    # Mutations
+    mutation_types = (
+        'modulate',
+        'diatonic_modulate',
+        'invert',
+        'reverse_melody',
+        'regenerate_melody',
+        'regenerate_rhythm'
+    )
+    mutation_cum_weights = tuple(accumulate([1, 5, 2, 1, 1, 2]))
+    modulate_shifts = tuple(range(-5, 0)) + tuple(range(1, 6))
+    diatonic_modulate_shifts = tuple(range(-4, 0)) + tuple(range(1, 5))
+
+    def __init__(self, arg_str_list=[], pattern_bank=None, admission=None, progressions=None):
+        self.decision, self.estimate = None, None
+        if admission is not None:
+            self.decision, arg_str_list, self.estimate = admission.check(arg_str_list)
+        self.args = validate_args(arg_str_list)
+        self.pattern_bank = pattern_bank
+        self.progressions = progressions
+        if self.args.scale is not None:
+            keys = [self.args.key] if self.args.key is not None else range(12)
+            self.scales = {key: Scale(key, self.args.scale, self.args.mode) for key in keys}
+        else:
+            self.scales = None
+
+    def execute(self, seed=None, filepath=None, events_path=None, cancel_token=None, truncate=False,
+                sections=None, checkpoints=None, memory_tracker=None):
+        """
+        Generate one song with the given seed, the same song as run() with the plan's 
+        arguments and '--seed seed'. The other arguments are as in run(), except that 
+        no MIDI file is written by default.
+
+        For addressable (--addressable 1) gentype 1 and 3 songs, sections (a range) 
+        limits the output to those sections, and checkpoints (a Checkpoints) stores the 
+        pattern state every checkpoints.interval sections. Generation resumes from the 
+        latest checkpoint before sections.start, so seeking to any section costs at most 
+        checkpoints.interval mutation steps once the checkpoints exist.
+
+        If memory_tracker (a MemoryTracker) is given, the memory allocated in each 
+        generation phase is recorded in it and MemoryBudgetExceeded is raised once its 
+        budget is exceeded.
+        """
+        args = argparse.Namespace(**vars(self.args))
+        args.seed = str(seed) if seed is not None else None
+        random.seed(args.seed)
+        resolve_random_args(args)
+        if memory_tracker is None:
+            return generate(self, args, filepath, events_path, cancel_token, truncate, sections, checkpoints)
+        with memory_tracker:
+            return generate(self, args, filepath, events_path, cancel_token, truncate, sections, checkpoints, 
+                            memory_tracker)
+
+
+    def variations(self, seed, k, filepaths=None):
+        """
+        Generate k variations of the song that execute(seed) generates (gentype 2 or 4). 
+        The variations have the song's scale, tempo, instruments and pattern types and 
+        the rhythms of its pitched patterns. The notes, drum onsets and volumes of each 
+        pattern are sampled for all k variations at once with the batch samplers of the 
+        pattern (see Pattern.batch_variations), so the cost is close to one song. The 
+        variations are reproducible for the same seed and k. Returns a list of k 
+        EventTables; if filepaths is given, variation i is also written to filepaths[i] 
+        as MIDI.
+        """
+        args = argparse.Namespace(**vars(self.args))
+        args.seed = str(seed) if seed is not None else None
+        random.seed(args.seed)
+        resolve_random_args(args)
+        variation_tables = generate(self, args, None, None, None, False, variations=k)
+        for variation_table, filepath in zip(variation_tables, filepaths or []):
+            encode(variation_table, filepath, 'midi')
+        return variation_tables
+
+
+class Checkpoints:
+    """
+    Saved pattern states of one addressable song (same plan and seed), for generating 
+    a section without generating all the sections before it.
+
+    Attributes:
+        interval: int               A state is saved after every interval-th section.
+        states: dict[int, tuple]    (patterns, keys used, program changes) after each saved section.
+        args: dict                  Arguments of the song the states belong to.
+    """
+    def __init__(self, interval=8):
+        self.interval = interval
+        self.states = {}
+        self.args = None
+
+    def latest(self, section):
+        """
+        Index of the latest saved section not after section, or None.
+        """
+        saved = [x for x in self.states if x <= section]
+        return max(saved) if saved else None
+
+
+def run(arg_str_list=[], filepath='midis/test.mid', events_path=None, cancel_token=None, truncate=False,
+        memory_tracker=None, admission=None):
+    """
+    Generate a song and write it to a MIDI file at filepath (a path or an open binary 
+    file, skipped if filepath is None). If events_path is given, the note events are 
+    also saved there as columnar .npz arrays (see EventTable.to_columns). Returns the 
+    EventTable of the generated note events.
+
+    The generators check cancel_token (a CancellationToken) between sections and 
+    tracks. Once it is cancelled or its deadline has passed, Cancelled is raised, or 
+    if truncate is True, generation stops and the song generated so far is written 
+    and returned with event_table.truncated set.
+
+    If memory_tracker (a MemoryTracker) is given, peak and retained allocations are 
+    recorded per generation phase and pattern class, and generation is aborted with 
+    MemoryBudgetExceeded if the tracker's budget is exceeded.
+
+    If admission (a cost.AdmissionControl) is given, the estimated cost of the song is 
+    checked before generation: rejected songs raise JobRejected and downscaled songs 
+    are generated with the reduced arguments.
+    """
+    plan = GenerationPlan(arg_str_list, admission=admission)
+    return plan.execute(plan.args.seed, filepath, events_path, cancel_token, truncate, 
+                        memory_tracker=memory_tracker)
+
+
+def generate(plan, args, filepath, events_path, cancel_token, truncate, sections=None, checkpoints=None,
+             memory_tracker=None, variations=None):
+    """
+    Generate a song from a GenerationPlan and resolved args (see run and GenerationPlan.execute).
+    If variations is given, returns the EventTables of that many variations of the song 
+    instead (see GenerationPlan.variations).
+    """
+    assert not args.addressable or args.seed is not None, 'addressable mode requires a seed'
+    if sections is not None or checkpoints is not None:
+        assert args.gentype in [1, 3] and args.addressable, 'sections require an addressable gentype 1 or 3 song'
+    if checkpoints is not None:
+        if checkpoints.args is None:
+            checkpoints.args = dict(vars(args))
+        assert checkpoints.args == vars(args), 'checkpoints belong to a different song'
 
     #=====================================================================#
     #                 Create MIDI file, define parameters                 #
     #=====================================================================#
 
 
-    midi_file = MIDIFile(args.numtracks)
+    event_table = EventTable(args.numtracks, args.tempo)
 
-    for track in range(args.numtracks):
-        midi_file.addTempo(track, time=0, tempo=args.tempo * 4)   # TODO
+    # Variations are sampled from their own generator, so the song itself is not changed
+    variation_tables = []
+    if variations is not None:
+        assert args.gentype in [2, 4], 'variations require gentype 2 or 4'
+        variation_tables = [EventTable(args.numtracks, args.tempo) for _ in range(variations)]
+        variation_rng = np.random.default_rng(random.Random(f'{args.seed}:variations').getrandbits(64))
 
     store_info = False
 
@@ -131,26 +336,21 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
 
 
     instruments_used = []
+    program_changes = []
 
     # Allowed instruments
-    all_instruments = [1,8,10,11,12,15,23,35,45,46,48,49,50,51,52,62,71,72,73,74,75,76,78,79,88,89,90,102,114]
-    bass_instruments = [0,33,35,48,49,50,51,62]
-    arp_instruments = [90,102]
+    all_instruments = plan.all_instruments
+    bass_instruments = plan.bass_instruments
+    arp_instruments = plan.arp_instruments
 
     # Patterns
-    all_pattern_types = [Bass, SimpleBass, SimpleBass2, SimpleBass3, Harmonic, Arpeggio, \
-                        LowMelodic, MidMelodic, HighMelodic, PercussionSingle, BassDrum, \
-                        Snare, Cymbals, AccentCymbals]
-
-    percussion_pattern_types = [PercussionSingle, BassDrum, Snare, Cymbals, AccentCymbals]
-
-    bass_pattern_types = [Bass, SimpleBass, SimpleBass2, SimpleBass3]
-
-    melody_pattern_types = [LowMelodic, MidMelodic, HighMelodic]
+    percussion_pattern_types = plan.percussion_pattern_types
+    bass_pattern_types = plan.bass_pattern_types
+    melody_pattern_types = plan.melody_pattern_types
 
     # Max 1 bass type and 2 melody types
     bass = random.choice(bass_pattern_types)
-    melodies = melody_pattern_types.copy()
+    melodies = list(melody_pattern_types)
     melody1 = random.choice(melodies)
     melodies.remove(melody1)
     melody2 = random.choice(melodies)
@@ -171,37 +371,134 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     if not args.arpeggio:
         allowed_pattern_types.remove(Arpeggio)
 
-    # Scales
-    nice_scale_types = [
-        'major',
-        'pentatonic',
-        'major_no4',
-        'major_no7'
-    ]
-
-    # Choose random scale if not given
-    if args.scale is None:
+    # Scales precomputed by the plan (same random draw as Scale() if the key is not given)
+    if plan.scales is not None:
+        key = args.key if args.key is not None else random.randint(0, 11)
+        scale = plan.scales[key]
+    else:
+        # Choose random scale if not given
         if args.nicescales:
-            args.scale = random.choice(nice_scale_types)
+            args.scale = random.choice(plan.nice_scale_types)
         else:
-            args.scale = random.choice(Scale.scale_types.keys())
-
-    scale = Scale(args.key, args.scale, args.mode)
+            args.scale = random.choice(list(Scale.scale_types.keys()))
+        scale = Scale(args.key, args.scale, args.mode)
     keys_used = [Scale.note_names[scale.key]]
 
 
-    def add_notes(track, channel, pattern, midi_file, repeat=0):
+    def cancelled():
         """
-        Add notes of a pattern to a midi file.
+        Whether generation should stop early. Raises Cancelled instead if not truncating.
         """
-        pattern.start_times = [x + pattern.total_length * repeat for x in pattern.start_times]
-        for i in range(len(pattern.notes)):
-            midi_file.addNote(track, 
-                            channel,
-                            pattern.notes[i],
-                            pattern.start_times[i],
-                            pattern.durations[i],
-                            pattern.volumes[i])
+        if memory_tracker is not None:
+            memory_tracker.check()
+        if cancel_token is None or not cancel_token.cancelled:
+            return False
+        if not truncate:
+            raise Cancelled('song generation cancelled')
+        event_table.truncated = True
+        return True
+
+    @contextmanager
+    def phase(name, pattern=None):
+        """
+        Context of a generation phase, per pattern class if given. The duration is 
+        recorded in the phase_seconds metric and the allocations in memory_tracker.
+        """
+        if pattern is not None:
+            name = f'{name}:{pattern.__class__.__name__}'
+        start_time = time.perf_counter()
+        with memory_tracker.phase(name) if memory_tracker is not None else nullcontext():
+            yield
+        phase_seconds.observe(time.perf_counter() - start_time, phase=name)
+
+    def new_pattern(pattern_type, pattern_scale, length, repeat, **kwargs):
+        """
+        Create and initialize a pattern in the current key, or sample an initialized 
+        pattern from plan.pattern_bank if the plan has one.
+        """
+        if plan.pattern_bank is not None:
+            return plan.pattern_bank.sample(pattern_type, scale.key, pattern_scale, length, repeat, **kwargs)
+        pattern = pattern_type(scale.key, pattern_scale, length, repeat, **kwargs)
+        with phase('initialize', pattern):
+            pattern.initialize()
+        return pattern
+
+    def limit_volumes(pattern, limit):
+        """
+        Limit the volumes of a pattern (generated volumes are at least 70, so a lower limit 
+        sets all volumes). The limit also applies to the variations of the pattern.
+        """
+        pattern.volume_limit = limit
+        pattern.volumes = [min(x, limit) for x in pattern.volumes]
+
+    def set_program(track, channel, instr):
+        """
+        Set the instrument of a track.
+        """
+        program_changes.append((track, channel, instr))
+        instruments_used.append(str(instr))
+        event_table.set_program(track, instr, channel)
+        for variation_table in variation_tables:
+            variation_table.set_program(track, instr, channel)
+
+    def add_notes(track, channel, pattern, repeat=0, section=0):
+        """
+        Add notes of a pattern to the event table. Section is the 
+        section index of the notes (int or one int per note). Notes of sections outside 
+        the requested sections only advance the start times of the pattern.
+        """
+        with phase('add_notes', pattern):
+            pattern.start_times = [x + pattern.total_length * repeat for x in pattern.start_times]
+            if sections is not None and section not in sections:
+                return
+            event_table.add_notes(track, 
+                                  channel, 
+                                  pattern.notes, 
+                                  pattern.start_times, 
+                                  pattern.durations, 
+                                  pattern.volumes,
+                                  pattern.__class__.__name__,
+                                  section)
+            if not variation_tables:
+                return
+            offset = (pattern.start_times[0] // pattern.total_length) * pattern.total_length
+            variation_start_times, variation_notes, variation_volumes = pattern.batch_variations(
+                len(variation_tables), variation_rng)
+            for variation_table, start_times, notes, volumes in zip(
+                    variation_tables, variation_start_times + offset, variation_notes, variation_volumes):
+                # Per-note sections are the bars of drum patterns (gentype 4)
+                note_sections = section if isinstance(section, int) else start_times // args.length
+                variation_table.add_notes(track, 
+                                          channel, 
+                                          notes, 
+                                          start_times, 
+                                          pattern.durations, 
+                                          volumes,
+                                          pattern.__class__.__name__,
+                                          note_sections)
+
+    def restore_checkpoint():
+        """
+        Restore the latest checkpoint before the requested sections. Returns the 
+        restored patterns and the first section to generate.
+        """
+        if checkpoints is None or sections is None:
+            return [], 0
+        section = checkpoints.latest(sections.start - 1)
+        if section is None:
+            return [], 0
+        patterns, keys, programs = copy.deepcopy(checkpoints.states[section])
+        keys_used[:] = keys
+        for track, channel, instr in programs:
+            set_program(track, channel, instr)
+        return patterns, section + 1
+
+    def save_checkpoint(section, patterns):
+        """
+        Save the pattern state after every checkpoints.interval-th section.
+        """
+        if checkpoints is not None and section % checkpoints.interval == 0 and section not in checkpoints.states:
+            checkpoints.states[section] = copy.deepcopy((patterns, keys_used, program_changes))
 
     def add_info(param_filename, scale, keys_used, instruments_used, patterns):
         """
@@ -223,33 +520,113 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     #=====================================================================#
 
 
+    def mutate_patterns(patterns):
+        """
+        Mutate a set of patterns with a randomly chosen mutation type.
+        """
+        # Choose random mutation type
+        mutation = random.choices(plan.mutation_types, cum_weights=plan.mutation_cum_weights, k=1)[0]
+        mutations.inc(mutation=mutation)
+
+        if mutation == 'modulate':
+            modulations = []
+            successes = [False]
+            tries = 0
+            while not all(successes) and tries < 20:
+                tries += 1
+                shift = random.choice(plan.modulate_shifts)
+                modulations = []
+                successes = []
+                for _, _, pattern in patterns:
+                    success, new_notes, new_key, new_scale = pattern.modulate(shift)
+                    modulations.append((new_notes, new_key, new_scale))
+                    successes.append(success)
+            mutation_tries.observe(tries, mutation=mutation)
+            if all(successes):
+                new_key = modulations[0][1]
+                keys_used.append(Scale.note_names[new_key])
+                for i, (_, _, pattern) in enumerate(patterns):
+                    pattern.notes = modulations[i][0]
+                    pattern.key = modulations[i][1]
+                    pattern.scale = modulations[i][2]
+
+        elif mutation == 'diatonic_modulate':
+            modulations = []
+            successes = [False]
+            tries = 0
+            while not all(successes) and tries < 20:
+                tries += 1
+                shift = random.choice(plan.diatonic_modulate_shifts)
+                modulations = []
+                successes = []
+                for _, _, pattern in patterns:
+                    success, new_notes = pattern.diatonic_modulate(shift)
+                    modulations.append(new_notes)
+                    successes.append(success)
+            mutation_tries.observe(tries, mutation=mutation)
+            if all(successes):
+                for i, (_, _, pattern) in enumerate(patterns):
+                    pattern.notes = modulations[i]
+
+        elif mutation == 'invert':
+            for _, _, pattern in patterns:
+                if random.random() < 0.5:
+                    success = False
+                    tries = 0
+                    while not success and tries < 20:
+                        success, new_notes = pattern.invert()
+                        tries += 1
+                    mutation_tries.observe(tries, mutation=mutation)
+                    if success:
+                        pattern.notes = new_notes
+
+        elif mutation == 'reverse_melody':
+            for _, _, pattern in patterns:
+                if random.random() < 0.5:
+                    pattern.reverse_melody()
+
+        elif mutation == 'regenerate_melody':
+            for _, _, pattern in patterns:
+                if random.random() < 0.5:
+                    pattern.generate_melody()
+
+        elif mutation == 'regenerate_rhythm':
+            for _, _, pattern in patterns:
+                if random.random() < 0.5:
+                    pattern.regenerate_rhythm()
+
+
     def generate_music_1():
         """
         Generate a set of patterns based on a scale, mutate the patterns
         args.numpatterns - 1 times and write to an output midi file.
         """
 
-        patterns = []
+        patterns, first_section = restore_checkpoint()
+        last_section = min(sections.stop, args.numpatterns) if sections is not None else args.numpatterns
 
-        for i in range(args.numpatterns):
+        for section in range(first_section, last_section):
+            if cancelled():
+                break
 
             # Generate one set of patterns
-            if i == 0:
+            if section == 0:
 
                 available_patterns = allowed_pattern_types.copy()
 
                 for track in range(len(available_patterns)):    ##### bug
                 # for track in range(args.numtracks):
+                    if cancelled():
+                        break
                     channel = track
 
                     # Generate random pattern and initialize
-                    pattern = random.choice(available_patterns)(
-                        scale.key,
-                        scale.all_scale_notes,
+                    pattern = new_pattern(
+                        random.choice(available_patterns),
+                        scale.views,
                         args.length,
                         args.repeat
                     )
-                    pattern.initialize()
                     if args.limittracks:
                         available_patterns.remove(pattern.__class__) 
 
@@ -263,117 +640,33 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
                         instr = random.choice(arp_instruments)
                     else:
                         instr = random.choice(all_instruments)
-                    instruments_used.append(str(instr))
-                    midi_file.addProgramChange(track, channel, 0, instr)
+                    set_program(track, channel, instr)
                     
                     # Limit volumes
                     if pattern.__class__ == Harmonic:
-                        pattern.volumes = [50 for x in pattern.volumes]
+                        limit_volumes(pattern, 50)
                     # if pattern.__class__ in percussion_pattern_types:
                     #     pattern.volumes = [50 for x in pattern.volumes]
 
                     patterns.append((track, channel, pattern))
 
                     # Add notes to MIDI file
-                    for i in range(len(pattern.notes)):
-                        midi_file.addNote(track, 
-                                        channel,
-                                        pattern.notes[i],
-                                        pattern.start_times[i],
-                                        pattern.durations[i],
-                                        pattern.volumes[i])
+                    add_notes(track, channel, pattern)
 
             # Mutate patterns
             else:
 
-                # Choose random mutation type
-                mutation_types = [
-                    'modulate',
-                    'diatonic_modulate',
-                    'invert',
-                    'reverse_melody',
-                    'regenerate_melody',
-                    'regenerate_rhythm'
-                ]
-                mutation_weights = [1, 5, 2, 1, 1, 2]
-                mutation = random.choices(mutation_types, mutation_weights, k=1)[0]
-
-                if mutation == 'modulate':
-                    modulations = []
-                    successes = [False]
-                    tries = 0
-                    while not all(successes) and tries < 20:
-                        tries += 1
-                        shifts = list(range(-5, 0)) + list(range(1, 6))
-                        shift = random.choice(shifts)
-                        modulations = []
-                        successes = []
-                        for _, _, pattern in patterns:
-                            success, new_notes, new_key, new_scale = pattern.modulate(shift)
-                            modulations.append((new_notes, new_key, new_scale))
-                            successes.append(success)
-                    if all(successes):
-                        new_key = modulations[0][1]
-                        keys_used.append(Scale.note_names[new_key])
-                        for i, (_, _, pattern) in enumerate(patterns):
-                            pattern.notes = modulations[i][0]
-                            pattern.key = modulations[i][1]
-                            pattern.scale = modulations[i][2]
-                    
-                elif mutation == 'diatonic_modulate':
-                    modulations = []
-                    successes = [False]
-                    tries = 0
-                    while not all(successes) and tries < 20:
-                        tries += 1
-                        shifts = list(range(-4, 0)) + list(range(1, 5))
-                        shift = random.choice(shifts)
-                        modulations = []
-                        successes = []
-                        for _, _, pattern in patterns:
-                            success, new_notes = pattern.diatonic_modulate(shift)
-                            modulations.append(new_notes)
-                            successes.append(success)
-                    if all(successes):
-                        for i, (_, _, pattern) in enumerate(patterns):
-                            pattern.notes = modulations[i]
-
-                elif mutation == 'invert':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            success = False
-                            tries = 0
-                            while not success and tries < 20:
-                                success, new_notes = pattern.invert()
-                                tries += 1
-                            if success:
-                                pattern.notes = new_notes
-
-                elif mutation == 'reverse_melody':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            pattern.reverse_melody()
-
-                elif mutation == 'regenerate_melody':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            pattern.generate_melody()
-
-                elif mutation == 'regenerate_rhythm':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            pattern.regenerate_rhythm()
+                if args.addressable:
+                    # Mutation randomness depends only on the song seed and the section index
+                    random.seed(f'{args.seed}:{section}')
+                with phase('mutate'):
+                    mutate_patterns(patterns)
 
                 # Add notes to MIDI file
                 for track, channel, pattern in patterns:
-                    pattern.start_times = [x + pattern.total_length for x in pattern.start_times]
-                    for i in range(len(pattern.notes)):
-                        midi_file.addNote(track, 
-                                        channel,
-                                        pattern.notes[i],
-                                        pattern.start_times[i],
-                                        pattern.durations[i],
-                                        pattern.volumes[i])
+                    add_notes(track, channel, pattern, repeat=1, section=section)
+
+            save_checkpoint(section, patterns)
 
         if store_info:
             # Write scale, instrument, pattern information to text file
@@ -405,6 +698,7 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
             chords = generate_chord_progression(scale, args.chordproglen)
         else:
             chords = generate_chord_progression(scale)
+        chords = [ScaleViews(chord) for chord in chords]
 
         allowed_pattern_types = [
             # Percussion,
@@ -414,24 +708,25 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
             # MidMelodic
         ]
 
-        running_length = 0
-
-        for chord in chords:
+        for chord_idx, chord in enumerate(chords):
+            if cancelled():
+                break
 
             available_patterns = allowed_pattern_types.copy()
 
             for track in range(args.numtracks):
+                if cancelled():
+                    break
                 patterns = []
                 channel = track
 
                 # Generate random pattern and initialize
-                pattern = random.choice(available_patterns)(
-                    scale.key,
+                pattern = new_pattern(
+                    random.choice(available_patterns),
                     chord,
                     args.length,
                     args.repeat
                 )
-                pattern.initialize()
                 available_patterns.remove(pattern.__class__) 
 
                 # Choose instrument
@@ -444,28 +739,19 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
                     instr = random.choice(arp_instruments)
                 else:
                     instr = random.choice(all_instruments)
-                
-                instruments_used.append(str(instr))
-                midi_file.addProgramChange(track, channel, 0, instr)
+
+                set_program(track, channel, instr)
                 
                 # Limit volumes
                 if pattern.__class__ == Harmonic:
-                    pattern.volumes = [50 for x in pattern.volumes]
+                    limit_volumes(pattern, 50)
                 # elif pattern.__class__ == percussion_pattern_types:
                 #     pattern.volumes = [50 for x in pattern.volumes]
 
                 patterns.append((track, channel, pattern))
 
                 # Add notes to MIDI file
-                for i in range(len(pattern.notes)):
-                    midi_file.addNote(track, 
-                                    channel,
-                                    pattern.notes[i],
-                                    pattern.start_times[i] + running_length,
-                                    pattern.durations[i],
-                                    pattern.volumes[i])
-
-            running_length += args.length * args.repeat
+                add_notes(track, channel, pattern, repeat=chord_idx, section=chord_idx)
 
         if store_info:
             # Write scale, instrument, pattern information to text file
@@ -489,12 +775,15 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
 
         TODO: 9+ tracks -> channel 9 percussion (better fix)
         """
-        patterns = []
+        patterns, first_section = restore_checkpoint()
+        last_section = min(sections.stop, args.numpatterns) if sections is not None else args.numpatterns
 
-        for i in range(args.numpatterns):
+        for section in range(first_section, last_section):
+            if cancelled():
+                break
 
             # Generate one set of patterns
-            if i == 0:
+            if section == 0:
 
                 available_patterns = [
                     bass,
@@ -528,6 +817,8 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
                     last_track_number = args.numtracks
 
                 for track in range(last_track_number):
+                    if cancelled():
+                        break
                     channel = track
 
                     # Generate random pattern and initialize
@@ -543,13 +834,12 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
                         else:
                             pattern = random.choice(available_patterns)
 
-                    pattern = pattern(
-                                scale.key,
-                                scale.all_scale_notes,
+                    pattern = new_pattern(
+                                pattern,
+                                scale.views,
                                 args.length,
                                 args.repeat
                             )
-                    pattern.initialize()
 
                     if not args.allpatterns and pattern.__class__ not in [PercussionSingle, Cymbals]:
                         available_patterns.remove(pattern.__class__) 
@@ -565,117 +855,33 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
                     else:
                         instr = random.choice(all_instruments)
 
-                    instruments_used.append(str(instr))
-                    midi_file.addProgramChange(track, channel, 0, instr)
+                    set_program(track, channel, instr)
                     
                     # Limit volumes
                     if pattern.__class__ in [Harmonic, PercussionSingle, Cymbals, AccentCymbals]:
-                        pattern.volumes = [40 for x in pattern.volumes]
+                        limit_volumes(pattern, 40)
                     # elif pattern.__class__ in percussion_pattern_types:
                     #     pattern.volumes = [50 for x in pattern.volumes]
 
                     patterns.append((track, channel, pattern))
 
                     # Add notes to MIDI file
-                    for i in range(len(pattern.notes)):
-                        midi_file.addNote(track, 
-                                        channel,
-                                        pattern.notes[i],
-                                        pattern.start_times[i],
-                                        pattern.durations[i],
-                                        pattern.volumes[i])
+                    add_notes(track, channel, pattern)
 
             # Mutate patterns
             else:
 
-                # Choose random mutation type
-                mutation_types = [
-                    'modulate',
-                    'diatonic_modulate',
-                    'invert',
-                    'reverse_melody',
-                    'regenerate_melody',
-                    'regenerate_rhythm'
-                ]
-                mutation_weights = [1, 5, 2, 1, 1, 2]
-                mutation = random.choices(mutation_types, mutation_weights, k=1)[0]
-
-                if mutation == 'modulate':
-                    modulations = []
-                    successes = [False]
-                    tries = 0
-                    while not all(successes) and tries < 20:
-                        tries += 1
-                        shifts = list(range(-5, 0)) + list(range(1, 6))
-                        shift = random.choice(shifts)
-                        modulations = []
-                        successes = []
-                        for _, _, pattern in patterns:
-                            success, new_notes, new_key, new_scale = pattern.modulate(shift)
-                            modulations.append((new_notes, new_key, new_scale))
-                            successes.append(success)
-                    if all(successes):
-                        new_key = modulations[0][1]
-                        keys_used.append(Scale.note_names[new_key])
-                        for i, (_, _, pattern) in enumerate(patterns):
-                            pattern.notes = modulations[i][0]
-                            pattern.key = modulations[i][1]
-                            pattern.scale = modulations[i][2]
-                    
-                elif mutation == 'diatonic_modulate':
-                    modulations = []
-                    successes = [False]
-                    tries = 0
-                    while not all(successes) and tries < 20:
-                        tries += 1
-                        shifts = list(range(-4, 0)) + list(range(1, 5))
-                        shift = random.choice(shifts)
-                        modulations = []
-                        successes = []
-                        for _, _, pattern in patterns:
-                            success, new_notes = pattern.diatonic_modulate(shift)
-                            modulations.append(new_notes)
-                            successes.append(success)
-                    if all(successes):
-                        for i, (_, _, pattern) in enumerate(patterns):
-                            pattern.notes = modulations[i]
-
-                elif mutation == 'invert':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            success = False
-                            tries = 0
-                            while not success and tries < 20:
-                                success, new_notes = pattern.invert()
-                                tries += 1
-                            if success:
-                                pattern.notes = new_notes
-
-                elif mutation == 'reverse_melody':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            pattern.reverse_melody()
-
-                elif mutation == 'regenerate_melody':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            pattern.generate_melody()
-
-                elif mutation == 'regenerate_rhythm':
-                    for _, _, pattern in patterns:
-                        if random.random() < 0.5:
-                            pattern.regenerate_rhythm()
+                if args.addressable:
+                    # Mutation randomness depends only on the song seed and the section index
+                    random.seed(f'{args.seed}:{section}')
+                with phase('mutate'):
+                    mutate_patterns(patterns)
 
                 # Add notes to MIDI file
                 for track, channel, pattern in patterns:
-                    pattern.start_times = [x + pattern.total_length for x in pattern.start_times]
-                    for i in range(len(pattern.notes)):
-                        midi_file.addNote(track, 
-                                        channel,
-                                        pattern.notes[i],
-                                        pattern.start_times[i],
-                                        pattern.durations[i],
-                                        pattern.volumes[i])
+                    add_notes(track, channel, pattern, repeat=1, section=section)
+
+            save_checkpoint(section, patterns)
 
         if store_info:
             # Write scale, instrument, pattern information to text file
@@ -711,36 +917,40 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
             PercussionSingle
         ]
 
-        chord_prog = ChordProgression(scale, length=args.chordproglen, voicing=args.voicing)
+        progression = {}
+        if plan.progressions is not None:
+            progression = plan.progressions.sample(args.chordproglen, len(scale.scale_type), args.voicing)
+        chord_prog = ChordProgression(scale, length=args.chordproglen, voicing=args.voicing, 
+                                      voice_leading=args.voiceleading, **progression)
 
         for track, pattern_type in enumerate(default_pattern_types):
+            if cancelled():
+                break
 
             if pattern_type in percussion_pattern_types:
                 channel = 9
                 instr = 0
-                instruments_used.append(str(instr))
-                midi_file.addProgramChange(track, channel, 0, instr)
+                set_program(track, channel, instr)
 
                 drum_pattern_bars = 2  # args.___
                 drum_pattern_repeat = chord_prog.total_length // drum_pattern_bars  # remainder
 
-                pattern = pattern_type(
-                    scale.key,
-                    scale.all_scale_notes,
+                pattern = new_pattern(
+                    pattern_type,
+                    scale.views,
                     args.length * drum_pattern_bars,
                     drum_pattern_repeat,
                     rigidity=args.rigidity
                 )
-                pattern.initialize()
 
                 if pattern_type in [PercussionSingle, Cymbals, AccentCymbals]:
-                    pattern.volumes = [40 for x in pattern.volumes]
+                    limit_volumes(pattern, 40)
                 if pattern_type in [BassDrum, Snare]:
-                    for i, vol in enumerate(pattern.volumes):
-                        if vol > 75:
-                            pattern.volumes[i] = 75
+                    limit_volumes(pattern, 75)
 
-                add_notes(track, channel, pattern, midi_file)
+                # Drum patterns span the whole progression, section = bar of each note
+                bars = [x // args.length for x in pattern.start_times]
+                add_notes(track, channel, pattern, section=bars)
 
             else:
                 channel = (track % 16) if (track % 16) != 9 else 8
@@ -748,22 +958,27 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
                     instr = random.choice(bass_instruments)
                 else: 
                     instr = random.choice(all_instruments)
-                instruments_used.append(str(instr))
-                midi_file.addProgramChange(track, channel, 0, instr)
-
-                for bar, chord in enumerate(chord_prog.chord_progression_notes):
-                    pattern = pattern_type(
-                        scale.key,
-                        chord,
+                set_program(track, channel, instr)
+
+                for bar, chord_views in enumerate(chord_prog.chord_progression_views):
+                    if cancelled():
+                        break
+                    # With voice leading, chord patterns play the realized voicing of the bar
+                    kwargs = {}
+                    if chord_prog.voiced_chords is not None and pattern_type in [Harmonic, Arpeggio]:
+                        kwargs['voicing'] = tuple(chord_prog.voiced_chords[bar % chord_prog.length])
+                    pattern = new_pattern(
+                        pattern_type,
+                        chord_views,
                         args.length,
-                        1   # args.repeat
+                        1,  # args.repeat
+                        **kwargs
                     )
-                    pattern.initialize()
 
                     if pattern_type == Harmonic:
-                        pattern.volumes = [35 for x in pattern.volumes]
+                        limit_volumes(pattern, 35)
 
-                    add_notes(track, channel, pattern, midi_file, repeat=bar)
+                    add_notes(track, channel, pattern, repeat=bar, section=bar)
 
 
 
@@ -779,9 +994,31 @@ def run(arg_str_list=[], filepath='midis/test.mid'):
     elif args.gentype == 4:
         generate_music_4()
 
-    # Write to MIDI
-    with open(filepath, 'wb') as output_file:
-        midi_file.writeFile(output_file)
+    if variations is not None:
+        for variation_table in variation_tables:
+            if args.normalize:
+                for kind, count in variation_table.collapse_notes().items():
+                    notes_collapsed.inc(count, kind=kind)
+            variation_table.args = dict(vars(args))
+        songs_generated.inc(variations, gentype=args.gentype)
+        return variation_tables
+
+    # Merge duplicate and overlapping notes before encoding
+    if args.normalize:
+        for kind, count in event_table.collapse_notes().items():
+            notes_collapsed.inc(count, kind=kind)
+
+    # Encode the song to MIDI and columnar arrays
+    event_table.args = dict(vars(args))
+    with phase('encode'):
+        if filepath is not None:
+            encode(event_table, filepath, 'midi')
+        if events_path is not None:
+            encode(event_table, events_path, 'npz')
+
+    songs_generated.inc(gentype=args.gentype)
+    song_events.observe(len(event_table))
+    return event_table
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+
+from music.create_midi import GenerationPlan
+from music.events import EVENT_DTYPE
+from music.parallel import generate_shared
+
+
+class DatasetWriter:
+    """
+    Write the note events of many songs into one packed binary file.
+
+    The events of all songs are appended back to back as EVENT_DTYPE records to
+    '<path>.events'. On close, the song offsets are written to '<path>.index.npy'
+    (song i is events[offsets[i]:offsets[i+1]]) and the record dtype, generation args
+    and collapsed note counts (see EventTable.collapse_notes) of each song to 
+    '<path>.json'.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.events_file = open(path + '.events', 'wb')
+        self.offsets = [0]
+        self.songs = []
+        self.collapsed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, events, args=None, collapsed=None):
+        """
+        Append the events (array of EVENT_DTYPE records), args and collapsed note counts 
+        of one song.
+        """
+        events = np.asarray(events, dtype=EVENT_DTYPE)
+        self.events_file.write(events.tobytes())
+        self.offsets.append(self.offsets[-1] + len(events))
+        self.songs.append(args)
+        self.collapsed.append(collapsed)
+
+    def close(self):
+        """
+        Close the events file and write the index and metadata files.
+        """
+        if self.events_file.closed:
+            return
+        self.events_file.close()
+        np.save(self.path + '.index.npy', np.array(self.offsets, dtype=np.int64))
+        with open(self.path + '.json', 'w') as metadata_file:
+            json.dump({'dtype': EVENT_DTYPE.descr, 'songs': self.songs, 'collapsed': self.collapsed}, metadata_file)
+
+
+class DatasetReader:
+    """
+    Read a dataset written by DatasetWriter.
+
+    The events file is memory-mapped, so reader[i] returns the events of song i as
+    a view into the file without copying.
+    """
+    def __init__(self, path):
+        self.offsets = np.load(path + '.index.npy')
+        with open(path + '.json') as metadata_file:
+            self.metadata = json.load(metadata_file)
+        if self.offsets[-1] > 0:
+            self.events = np.memmap(path + '.events', dtype=EVENT_DTYPE, mode='r')
+        else:
+            # np.memmap cannot map an empty file
+            self.events = np.empty(0, dtype=EVENT_DTYPE)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        i = range(len(self))[i]
+        return self.events[self.offsets[i]:self.offsets[i+1]]
+
+    def args(self, i):
+        """
+        Return the generation args of song i.
+        """
+        return self.metadata['songs'][i]
+
+    def collapsed(self, i):
+        """
+        Return the collapsed note counts of song i (None if it was not normalized).
+        """
+        return self.metadata.get('collapsed', [None] * len(self))[i]
+
+
+def generate_dataset(path, seeds, arg_str_list=[], columns_dir=None, processes=None, pattern_bank=None,
+                     progressions=None):
+    """
+    Generate one song per seed with otherwise the same arguments and write the events
+    of all songs to a packed dataset at path (see DatasetWriter). No MIDI files are
+    written. If columns_dir is given, the columnar event table of each song is also
+    saved there as '<seed>.npz' (see EventTable.save_npz).
+
+    If processes is given (and columns_dir is not), the songs are generated in that many
+    worker processes and their events are passed back through shared memory (see
+    parallel.generate_shared). If pattern_bank (a PatternBank) is given, the songs sample 
+    their initialized patterns from it; each worker process uses its own copy. Likewise 
+    for progressions (a ProgressionSampler) and the chord progressions.
+    """
+    plan = GenerationPlan(arg_str_list, pattern_bank=pattern_bank, progressions=progressions)
+    with DatasetWriter(path) as writer:
+        if processes is not None and columns_dir is None:
+            for result in generate_shared(plan, seeds, processes):
+                writer.append(result.open(), result.args, result.collapsed)
+                result.release()
+            return
+        for seed in seeds:
+            events_path = os.path.join(columns_dir, f'{seed}.npz') if columns_dir is not None else None
+            event_table = plan.execute(seed, events_path=events_path)
+            writer.append(event_table.to_array(), event_table.args, event_table.collapsed)
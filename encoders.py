@@ -0,0 +1,94 @@
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from music.midifile import GridMIDIFile
+from music.metrics import bytes_written
+
+
+class Encoder(ABC):
+    """
+    Abstract base class for output backends.
+
+    Generation produces an EventTable (tracks, programs, tempo and note events) without
+    knowing about any output format. An encoder writes an EventTable to a target, so a
+    song is generated once and can be encoded to any number of outputs.
+    """
+    @abstractmethod
+    def encode(self, event_table, target):
+        """
+        Write event_table to target (a path or an open binary file).
+        """
+        pass
+
+
+class MidiEncoder(Encoder):
+    """
+    Standard MIDI file with one track per song track and the tempo set on every track.
+    """
+    def encode(self, event_table, target):
+        num_tracks = event_table.num_tracks
+        if num_tracks is None:
+            num_tracks = int(event_table.tracks.max()) + 1 if len(event_table) else 1
+        midi_file = GridMIDIFile(num_tracks)
+        for track in range(num_tracks):
+            midi_file.addTempo(track, time=0, tempo=event_table.tempo * 4)   # TODO
+        for track, channel, program in event_table.program_changes:
+            midi_file.addProgramChange(track, channel, 0, program)
+        table = event_table.table
+        for track in range(num_tracks):
+            notes = table[table['track'] == track]
+            if len(notes):
+                midi_file.addNotes(track, *[notes[name] for name in ['channel', 'pitch', 'start', 'duration', 'velocity']])
+
+        if hasattr(target, 'write'):
+            midi_file.writeFile(target)
+        else:
+            with open(target, 'wb') as output_file:
+                midi_file.writeFile(output_file)
+
+
+class NpzEncoder(Encoder):
+    """
+    Columnar .npz arrays (see EventTable.to_columns).
+    """
+    def encode(self, event_table, target):
+        event_table.save_npz(target)
+
+
+class ArrayEncoder(Encoder):
+    """
+    .npy file of EVENT_DTYPE records (see EventTable.to_array).
+    """
+    def encode(self, event_table, target):
+        np.save(target, event_table.to_array())
+
+
+# Encoders by output format name
+encoders = {
+    'midi': MidiEncoder(),
+    'npz': NpzEncoder(),
+    'npy': ArrayEncoder()
+}
+
+
+# File extensions added by numpy to paths without them
+format_extensions = {'npz': '.npz', 'npy': '.npy'}
+
+
+def encode(event_table, target, format='midi'):
+    """
+    Write event_table to target with the encoder registered for format in encoders. 
+    The bytes written are counted in the bytes_written metric.
+    """
+    assert format in encoders, f'format must be one of {list(encoders)}'
+    start = target.tell() if hasattr(target, 'write') else 0
+    encoders[format].encode(event_table, target)
+    if hasattr(target, 'write'):
+        size = target.tell() - start
+    else:
+        path = os.fspath(target)
+        extension = format_extensions.get(format, '')
+        size = os.path.getsize(path if path.endswith(extension) else path + extension)
+    bytes_written.inc(size, format=format)
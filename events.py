@@ -0,0 +1,280 @@
+import numpy as np
+
+from music.timeindex import TimeIndex
+
+
+# Packed record of one note event. Start times and durations are in 1/16th note steps.
+EVENT_DTYPE = np.dtype([
+    ('track', 'u1'),
+    ('channel', 'u1'),
+    ('program', 'u1'),
+    ('pitch', 'u1'),
+    ('velocity', 'u1'),
+    ('start', '<u4'),
+    ('duration', '<u4')
+])
+
+
+# Columns of an EventTable. Pattern is an index into EventTable.pattern_names.
+TABLE_DTYPE = np.dtype([
+    ('track', 'u1'),
+    ('channel', 'u1'),
+    ('pitch', 'u1'),
+    ('velocity', 'u1'),
+    ('pattern', 'u1'),
+    ('section', '<u2'),
+    ('start', '<u4'),
+    ('duration', '<u4')
+])
+
+
+class EventTable:
+    """
+    Note events of a generated song, collected while the song is generated.
+
+    This is the backend-neutral representation of a song between generation and 
+    output: encoders (see encoders.py) write it to MIDI, arrays or other formats.
+    The events are stored as TABLE_DTYPE records in a preallocated array that grows 
+    by doubling, so adding the notes of a pattern is one slice assignment per column 
+    and the array outputs need no per-event conversion.
+
+    Attributes:
+        num_tracks: int             Number of tracks of the song.
+        tempo: int                  Tempo in beats (4 steps) per minute.
+        programs: dict[int, int]    Program (instrument) of each track.
+        program_changes: list[tuple]    (track, channel, program) of each program change in order.
+        events: np.ndarray          TABLE_DTYPE records; the first len(self) are the events.
+        pattern_names: list[str]    Pattern class names indexed by the 'pattern' column.
+        args: dict                  Generation arguments of the song.
+        truncated: bool             Whether generation was cancelled before the song was complete.
+        collapsed: dict             Numbers of merged duplicates and trimmed overlaps (see collapse_notes).
+
+    The columns of the events are also available as arrays: tracks, channels, pitches, 
+    start_times, durations, velocities and sections, and patterns as a list of names.
+    """
+    def __init__(self, num_tracks=None, tempo=None, capacity=256):
+        self.num_tracks = num_tracks
+        self.tempo = tempo
+        self.programs = {}
+        self.program_changes = []
+        self.events = np.empty(capacity, dtype=TABLE_DTYPE)
+        self.size = 0
+        self.pattern_names = []
+        self.pattern_codes = {}
+        self.args = None
+        self.truncated = False
+        self.collapsed = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def table(self):
+        """
+        The events of the table (a view of the first len(self) records).
+        """
+        return self.events[:self.size]
+
+    @property
+    def tracks(self):
+        return self.table['track']
+
+    @property
+    def channels(self):
+        return self.table['channel']
+
+    @property
+    def pitches(self):
+        return self.table['pitch']
+
+    @property
+    def start_times(self):
+        return self.table['start']
+
+    @property
+    def durations(self):
+        return self.table['duration']
+
+    @property
+    def velocities(self):
+        return self.table['velocity']
+
+    @property
+    def sections(self):
+        return self.table['section']
+
+    @property
+    def patterns(self):
+        return [self.pattern_names[i] for i in self.table['pattern']]
+
+    def set_program(self, track, program, channel=0):
+        """
+        Set the program of a track. Applies to all events of the track.
+        """
+        self.programs[track] = program
+        self.program_changes.append((track, channel, program))
+
+    def reserve(self, size):
+        """
+        Grow the events array (at least doubling it) to hold size events.
+        """
+        if size > len(self.events):
+            events = np.empty(max(size, 2 * len(self.events)), dtype=TABLE_DTYPE)
+            events[:self.size] = self.table
+            self.events = events
+
+    def pattern_code(self, pattern_name):
+        """
+        Index of pattern_name in pattern_names, added if new.
+        """
+        if pattern_name not in self.pattern_codes:
+            self.pattern_codes[pattern_name] = len(self.pattern_names)
+            self.pattern_names.append(pattern_name)
+        return self.pattern_codes[pattern_name]
+
+    def add_notes(self, track, channel, notes, start_times, durations, velocities, 
+                  pattern_name=None, section=0):
+        """
+        Add the notes of one pattern to the table. The notes, start times, durations 
+        and velocities may be lists or arrays; extra start times, durations or 
+        velocities beyond len(notes) are ignored. Section is either the section index 
+        of all the notes or a list with one section index per note.
+        """
+        n = len(notes)
+        self.reserve(self.size + n)
+        events = self.events[self.size:self.size + n]
+        events['track'] = track
+        events['channel'] = channel
+        events['pitch'] = notes
+        events['start'] = start_times[:n]
+        events['duration'] = durations[:n]
+        events['velocity'] = velocities[:n]
+        events['pattern'] = self.pattern_code(pattern_name)
+        events['section'] = section if isinstance(section, int) else section[:n]
+        self.size += n
+
+    def collapse_notes(self):
+        """
+        Merge duplicate notes and trim overlapping notes in place, e.g. before encoding.
+
+        Notes of the same channel and pitch starting at the same time are merged into 
+        one note with the longest duration and highest velocity of the duplicates, also 
+        across tracks (e.g. the drum tracks sharing channel 9), since a MIDI channel 
+        plays them as one note. A note that still sounds when the next note of the same 
+        channel and pitch starts is cut to end there. The remaining events keep their 
+        order. Returns (and stores in collapsed) the number of removed duplicates and 
+        trimmed overlaps.
+        """
+        table = self.table
+        channels = table['channel'].astype(np.int64)
+        pitches = table['pitch'].astype(np.int64)
+        starts = table['start'].astype(np.int64)
+        durations = table['duration'].astype(np.int64)
+        velocities = table['velocity'].astype(np.int64)
+
+        # Same notes next to each other by start time, the longest duplicate first
+        order = np.lexsort((-durations, starts, pitches, channels))
+        same_note = np.zeros(len(order), dtype=bool)
+        same_note[1:] = ((channels[order[1:]] == channels[order[:-1]])
+                         & (pitches[order[1:]] == pitches[order[:-1]]))
+        duplicate = np.zeros(len(order), dtype=bool)
+        duplicate[1:] = same_note[1:] & (starts[order[1:]] == starts[order[:-1]])
+
+        first_idxs = np.flatnonzero(~duplicate)
+        kept = order[first_idxs]
+        if len(order):
+            velocities[kept] = np.maximum.reduceat(velocities[order], first_idxs)
+        overlap = np.zeros(len(kept), dtype=bool)
+        overlap[:-1] = same_note[first_idxs[1:]] & (starts[kept[:-1]] + durations[kept[:-1]] > starts[kept[1:]])
+        durations[kept[overlap]] = starts[kept[1:]][overlap[:-1]] - starts[kept[overlap]]
+
+        idxs = np.sort(kept)
+        events = table[idxs]
+        events['duration'] = durations[idxs]
+        events['velocity'] = velocities[idxs]
+        self.events, self.size = events, len(events)
+        self.collapsed = {'duplicates': int(duplicate.sum()), 'overlaps': int(overlap.sum())}
+        return self.collapsed
+
+    def to_array(self, out=None):
+        """
+        Return the events as a structured array of EVENT_DTYPE records. If out is given 
+        (e.g. an array in shared memory), the records are written into it instead.
+        """
+        table = self.table
+        events = out if out is not None else np.empty(len(self), dtype=EVENT_DTYPE)
+        for name in ['track', 'channel', 'pitch', 'velocity', 'start', 'duration']:
+            events[name] = table[name]
+        events['program'] = self.program_lookup()[table['track']]
+        return events
+
+    def program_lookup(self):
+        """
+        Array of the program of each track number (0 for tracks without a program).
+        """
+        programs = np.zeros(256, dtype='u1')
+        for track, program in self.programs.items():
+            programs[track] = program
+        return programs
+
+    def time_index(self):
+        """
+        Return a TimeIndex of the events for windowed queries and seeking.
+        """
+        return TimeIndex(self.to_array())
+
+    def to_columns(self):
+        """
+        Return the events as a dict of equal-length column arrays. Pattern class 
+        names are dictionary-encoded: the 'pattern' column holds indices into the 
+        sorted 'pattern_names' array.
+        """
+        table = self.table
+        used_codes = np.unique(table['pattern'])
+        pattern_names = sorted(self.pattern_names[i] for i in used_codes)
+        codes = np.zeros(max(len(self.pattern_names), 1), dtype='u1')
+        for i in used_codes:
+            codes[i] = pattern_names.index(self.pattern_names[i])
+        return {
+            'track': table['track'].copy(),
+            'channel': table['channel'].copy(),
+            'program': self.program_lookup()[table['track']],
+            'pattern': codes[table['pattern']],
+            'section': table['section'].copy(),
+            'pitch': table['pitch'].copy(),
+            'velocity': table['velocity'].copy(),
+            'start': table['start'].copy(),
+            'duration': table['duration'].copy(),
+            'pattern_names': np.array(pattern_names, dtype=str)
+        }
+
+    def save_npz(self, path):
+        """
+        Save the columns returned by to_columns to an .npz file.
+        """
+        np.savez(path, **self.to_columns())
+
+
+def load_columns(paths):
+    """
+    Load and concatenate the event columns saved by EventTable.save_npz for several 
+    songs. Adds a 'song' column with the index of each event's file in paths and 
+    re-encodes the 'pattern' column against the combined 'pattern_names'.
+    """
+    columns = {}
+    pattern_names = {}
+    for song, path in enumerate(paths):
+        with np.load(path) as song_columns:
+            names = song_columns['pattern_names']
+            lookup = np.array([pattern_names.setdefault(name, len(pattern_names)) for name in names], dtype='u1')
+            for key in song_columns.files:
+                if key == 'pattern_names':
+                    continue
+                values = song_columns[key]
+                if key == 'pattern':
+                    values = lookup[values]
+                columns.setdefault(key, []).append(values)
+            columns.setdefault('song', []).append(np.full(len(song_columns['pitch']), song, dtype='<u4'))
+    columns = {key: np.concatenate(values) for key, values in columns.items()}
+    columns['pattern_names'] = np.array(list(pattern_names), dtype=str)
+    return columns
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+from music.create_midi import run
+
+
+# Seeds x gentypes x extra args checked by default
+default_grid = [
+    ['--seed', str(seed), '--gentype', str(gentype)] + extra_args
+    for seed in [1, 42, 777]
+    for gentype, extra_args in [
+        (1, []),
+        (1, ['--length', '16', '--repeat', '3', '--numpatterns', '5', '--rigidity', '0.3']),
+        (2, ['--numtracks', '3']),
+        (3, []),
+        (3, ['--length', '16', '--repeat', '3', '--numpatterns', '5', '--allpatterns', '1']),
+        (4, []),
+        (4, ['--rigidity', '1.0', '--chordproglen', '8', '--voicing', 'seventh']),
+        (4, ['--rigidity', '0.0', '--scale', 'pentatonic', '--mode', '2'])
+    ]
+]
+
+# Compatibility modes: 'bytes' requires byte-identical MIDI files, 'events' the same
+# set of note events regardless of their order
+compatibility_modes = ['bytes', 'events']
+
+CaseResult = namedtuple('CaseResult', ['args', 'equal', 'seconds', 'golden_seconds', 'speedup'])
+
+
+def time_engine(engine, arg_str_list, repeat=1):
+    """
+    Run engine(arg_str_list, filepath) (same interface as run) repeat times. Returns the
+    MIDI bytes, the event array and the fastest runtime.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, 'song.mid')
+        seconds = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                event_table = engine(arg_str_list, filepath)
+            seconds.append(time.perf_counter() - start_time)
+        with open(filepath, 'rb') as midi_file:
+            midi_bytes = midi_file.read()
+    return midi_bytes, event_table.to_array(), min(seconds)
+
+
+def sorted_events(events):
+    """
+    Events in a canonical order, for comparing event tables regardless of event order.
+    """
+    return np.sort(events, order=['track', 'start', 'pitch', 'duration', 'velocity', 'channel', 'program'])
+
+
+def record(golden_dir, grid=default_grid, engine=run, repeat=1):
+    """
+    Record the golden MIDI bytes, event arrays and runtimes of engine for each
+    arg_str_list in grid to golden_dir.
+    """
+    os.makedirs(golden_dir, exist_ok=True)
+    cases = []
+    for i, arg_str_list in enumerate(grid):
+        midi_bytes, events, seconds = time_engine(engine, arg_str_list, repeat)
+        name = f'case{i:03d}'
+        with open(os.path.join(golden_dir, name + '.mid'), 'wb') as midi_file:
+            midi_file.write(midi_bytes)
+        np.save(os.path.join(golden_dir, name + '.npy'), events)
+        cases.append({'name': name, 'args': arg_str_list, 'seconds': seconds})
+    with open(os.path.join(golden_dir, 'index.json'), 'w') as index_file:
+        json.dump(cases, index_file, indent=1)
+
+
+def check(golden_dir, engine=run, mode='bytes', repeat=1):
+    """
+    Check engine against the golden outputs in golden_dir under the given compatibility
+    mode. Returns a CaseResult with the correctness and speedup of each case.
+    """
+    assert mode in compatibility_modes, f'mode must be one of {compatibility_modes}'
+    with open(os.path.join(golden_dir, 'index.json')) as index_file:
+        cases = json.load(index_file)
+
+    results = []
+    for case in cases:
+        midi_bytes, events, seconds = time_engine(engine, case['args'], repeat)
+        if mode == 'bytes':
+            with open(os.path.join(golden_dir, case['name'] + '.mid'), 'rb') as midi_file:
+                equal = midi_bytes == midi_file.read()
+        else:
+            golden_events = np.load(os.path.join(golden_dir, case['name'] + '.npy'))
+            equal = (len(events) == len(golden_events)
+                     and bool((sorted_events(events) == sorted_events(golden_events)).all()))
+        results.append(CaseResult(case['args'], equal, seconds, case['seconds'], case['seconds'] / seconds))
+    return results
+
+
+def report(results):
+    """
+    Format check results as a text table with a summary line.
+    """
+    lines = [f'{"ok":4} {"speedup":>8} {"seconds":>9}  args']
+    for result in results:
+        status = 'ok' if result.equal else 'FAIL'
+        lines.append(f'{status:4} {result.speedup:8.2f} {result.seconds:9.4f}  {" ".join(result.args)}')
+    total_speedup = sum(x.golden_seconds for x in results) / sum(x.seconds for x in results)
+    failures = sum(not x.equal for x in results)
+    lines.append(f'{len(results) - failures}/{len(results)} equal, total speedup {total_speedup:.2f}x')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    # python -m music.golden record|check <golden_dir> [bytes|events]
+    command, golden_dir = sys.argv[1], sys.argv[2]
+    if command == 'record':
+        record(golden_dir)
+    else:
+        results = check(golden_dir, mode=sys.argv[3] if len(sys.argv) > 3 else 'bytes')
+        print(report(results))
+        sys.exit(0 if all(x.equal for x in results) else 1)
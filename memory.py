@@ -0,0 +1,112 @@
+import tracemalloc
+from contextlib import contextmanager
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    Raised when the memory traced by a MemoryTracker exceeds its budget.
+    """
+    pass
+
+
+class MemoryTracker:
+    """
+    Per-phase memory accounting of song generation with tracemalloc.
+
+    Generation phases (pattern initialization and note expansion per pattern class,
+    mutations, encoding) are wrapped in phase(name). For each phase name the number of
+    calls, the largest peak allocation above the memory in use when the phase started
+    and the total memory still allocated when it ended are recorded. If budget is given,
+    MemoryBudgetExceeded is raised as soon as a check finds more than budget bytes
+    allocated since start().
+
+    Attributes:
+        budget: int                 Maximum traced bytes, or None for no limit.
+        phases: dict[str, dict]     'calls', 'peak' and 'retained' bytes of each phase.
+        peak: int                   Peak traced bytes since start().
+    """
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.phases = {}
+        self.peak = 0
+        self.baseline = 0
+        self.started_tracing = False
+        self.stack = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Start tracing (if not already traced) and take the memory in use as the baseline.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def stop(self):
+        """
+        Record the overall peak and stop tracing if start() started it.
+        """
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1] - self.baseline)
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def check(self, phase=None):
+        """
+        Raise MemoryBudgetExceeded if the budget is exceeded.
+        """
+        if self.budget is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if max(current, peak) - self.baseline > self.budget:
+            if phase is None and self.stack:
+                phase = self.stack[-1][0]
+            raise MemoryBudgetExceeded(f'memory budget of {self.budget} bytes exceeded (phase {phase})')
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Account the allocations made inside the with block to phase name.
+        """
+        self.check()
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            # The peak is reset for this phase, keep the enclosing phase's peak so far
+            self.stack[-1][2] = max(self.stack[-1][2], peak)
+        else:
+            self.peak = max(self.peak, peak - self.baseline)
+        tracemalloc.reset_peak()
+        self.stack.append([name, current, 0])
+        try:
+            yield
+        finally:
+            name, start, inner_peak = self.stack.pop()
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, inner_peak)
+            stats = self.phases.setdefault(name, {'calls': 0, 'peak': 0, 'retained': 0})
+            stats['calls'] += 1
+            stats['peak'] = max(stats['peak'], peak - start)
+            stats['retained'] += current - start
+            if self.stack:
+                self.stack[-1][2] = max(self.stack[-1][2], peak)
+            else:
+                self.peak = max(self.peak, peak - self.baseline)
+        self.check(name)
+
+    def report(self):
+        """
+        Format the phase statistics as a text table, largest peak first.
+        """
+        lines = [f'{"phase":32} {"calls":>6} {"peak":>12} {"retained":>12}']
+        for name, stats in sorted(self.phases.items(), key=lambda x: -x[1]['peak']):
+            lines.append(f'{name:32} {stats["calls"]:6d} {stats["peak"]:12d} {stats["retained"]:12d}')
+        lines.append(f'{"total peak":32} {"":6} {self.peak:12d}')
+        return '\n'.join(lines)
@@ -0,0 +1,214 @@
+import os
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class Counter:
+    """
+    Monotonically increasing count, optionally split by label values.
+    """
+    type_name = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[x]) for x in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        (name suffix, label pairs, value) of each exposed sample.
+        """
+        with self.lock:
+            return [('', list(zip(self.labelnames, key)), value) for key, value in sorted(self.values.items())]
+
+    def drain(self):
+        """
+        Return the values (label values -> count) and reset them.
+        """
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values):
+        """
+        Add values returned by drain (e.g. of another process) to this counter.
+        """
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets (upper bounds), with the sum
+    and count of the observations, optionally split by label values.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # Label values -> [per-bucket counts (last is +Inf), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[x]) for x in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, (counts, total) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                samples.append(('_bucket', labels + [('le', str(bound))], cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+    def sums(self):
+        """
+        Sum of the observed values per label values (a tuple in labelnames order).
+        """
+        with self.lock:
+            return {key: total for key, (_, total) in self.values.items()}
+
+    def drain(self):
+        """
+        Return the values (label values -> (bucket counts, sum)) and reset them.
+        """
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values):
+        """
+        Add values returned by drain (e.g. of another process) to this histogram.
+        """
+        with self.lock:
+            for key, (counts, total) in values.items():
+                own_counts, own_total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+                self.values[key] = ([x + y for x, y in zip(own_counts, counts)], own_total + total)
+
+
+class Registry:
+    """
+    Collection of metrics exposed together in the Prometheus text format.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def drain(self):
+        """
+        Values of all metrics by name, reset to zero. Worker processes return these with 
+        their results so that the parent can merge them into its own registry.
+        """
+        return {metric.name: metric.drain() for metric in self.metrics}
+
+    def merge(self, values):
+        """
+        Add the values returned by drain (e.g. in a worker process) to the metrics.
+        """
+        for metric in self.metrics:
+            if metric.name in values:
+                metric.merge(values[metric.name])
+
+    def reset(self):
+        """
+        Reset all metrics, e.g. in a new worker process that inherited the values of its parent.
+        """
+        self.drain()
+
+    def exposition(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for suffix, labels, value in metric.samples():
+                label_str = ','.join(f'{name}="{value}"' for name, value in labels)
+                label_str = '{' + label_str + '}' if label_str else ''
+                lines.append(f'{metric.name}{suffix}{label_str} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the exposition to a file, e.g. at the end of a batch job. The file is
+        replaced atomically, so it can be read (e.g. by node_exporter's textfile
+        collector) while it is rewritten.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write(self.exposition())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host=''):
+        """
+        Serve the exposition over HTTP (any path) from a daemon thread. Returns the server.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Metrics of the generator. Each process has its own registry: the pools of parallel.py 
+# and batch.py reset it in their workers and merge the workers' values (see Registry.drain) 
+# back into the registry of the parent process.
+registry = Registry()
+
+songs_generated = registry.register(Counter(
+    'algomusic_songs_generated_total', 'Songs generated.', ['gentype']))
+song_events = registry.register(Histogram(
+    'algomusic_song_events', 'Note events per song.',
+    [100, 300, 1000, 3000, 10000, 30000, 100000, 300000]))
+bytes_written = registry.register(Counter(
+    'algomusic_bytes_written_total', 'Bytes written by the encoders.', ['format']))
+mutations = registry.register(Counter(
+    'algomusic_mutations_total', 'Mutation types chosen.', ['mutation']))
+mutation_tries = registry.register(Histogram(
+    'algomusic_mutation_tries', 'Tries of the retried mutations (at most 20).',
+    [1, 2, 3, 5, 10, 20], ['mutation']))
+notes_collapsed = registry.register(Counter(
+    'algomusic_notes_collapsed_total', 'Duplicate notes merged and overlapping notes trimmed by --normalize.', 
+    ['kind']))
+phase_seconds = registry.register(Histogram(
+    'algomusic_phase_seconds', 'Duration of generation phases.',
+    [1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1, 10], ['phase']))
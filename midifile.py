@@ -0,0 +1,256 @@
+import io
+import sys
+import time
+from bisect import bisect_left
+
+import numpy as np
+from midiutil import MIDIFile
+from midiutil.MidiFile import MIDITrack, NoteOn, NoteOff, sort_events
+
+
+def grid_order(keys):
+    """
+    Stable order of non-negative integer keys by LSD radix sort: one counting sort
+    (numpy's stable sort of 16-bit digits) per 16 bits of the largest key, so the cost
+    is linear in the number of keys. Keys on the tick grid of a song fit in one or two
+    digits.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    order = np.arange(len(keys))
+    max_key = int(keys.max()) if len(keys) else 0
+    shift = 0
+    while True:
+        digits = ((keys[order] >> shift) & 0xFFFF).astype(np.uint16)
+        order = order[np.argsort(digits, kind='stable')]
+        shift += 16
+        if max_key >> shift == 0:
+            return order
+
+
+def deinterleave_keys(pitches, channels):
+    """
+    Integer form of MIDITrack.deInterleaveNotes' note key str(pitch) + str(channel):
+    two notes get the same key exactly when their key strings are equal.
+    """
+    pitch_digits = 1 + (pitches >= 10) + (pitches >= 100)
+    channel_digits = 1 + (channels >= 10)
+    value = pitches * 10 ** channel_digits + channels
+    return value * 8 + pitch_digits + channel_digits
+
+
+class GridMIDITrack(MIDITrack):
+    """
+    MIDITrack that keeps its notes as integer columns (see GridMIDIFile.addNotes) and
+    orders them on the tick grid when the track is closed. Duplicates are removed, the
+    notes sorted with grid_order and deinterleaved on the columns, and the note events
+    are only created once, already in the order MIDITrack would give them. Other events
+    (program changes, tempos) are handled as in MIDITrack and merged in.
+    """
+    def __init__(self, removeDuplicates, deinterleave):
+        super().__init__(removeDuplicates, deinterleave)
+        self.note_columns = []
+
+    def addNotes(self, channels, pitches, ticks, durations, volumes, insertion_orders):
+        """
+        Add notes given as int64 arrays of ticks and MIDI values.
+        """
+        self.note_columns.append((channels, pitches, ticks, durations, volumes, insertion_orders))
+
+    def processEventList(self):
+        self.MIDIEventList = sorted(self.eventList, key=sort_events)
+        if self.note_columns:
+            self.MIDIEventList = self.merge_events(self.note_events(), self.MIDIEventList)
+
+    def note_events(self):
+        """
+        NoteOn and NoteOff events of the notes in order: duplicates removed, sorted by
+        (tick, sec_sort_order, insertion_order) and deinterleaved as in MIDITrack.
+        """
+        channels, pitches, ticks, durations, volumes, insertion_orders = [
+            np.concatenate(column) for column in zip(*self.note_columns)]
+        count = len(ticks)
+
+        # Event i < count is the NoteOn and event count + i the NoteOff of note i
+        event_notes = np.concatenate([np.arange(count), np.arange(count)])
+        event_ticks = np.concatenate([ticks, ticks + durations])
+        is_note_on = np.arange(2 * count) < count
+        sec_sort_orders = np.where(is_note_on, NoteOn.sec_sort_order, NoteOff.sec_sort_order)
+        ids = np.arange(2 * count)
+
+        if self.remdep:
+            # Equal events (same type, tick, pitch and channel): keep the first added
+            identities = ((event_ticks * 2 + is_note_on) * 16 + channels[event_notes]) * 128 + pitches[event_notes]
+            _, first_ids = np.unique(identities, return_index=True)
+            ids = np.sort(first_ids)
+
+        # Ticks are multiples of the grid step, so the keys are small integers. Events with
+        # equal keys have the same type and stay in insertion order.
+        grid_step = max(int(np.gcd.reduce(event_ticks[ids])), 1)
+        order = ids[grid_order((event_ticks[ids] // grid_step) * 4 + sec_sort_orders[ids])]
+
+        if self.deinterleave:
+            order = self.deinterleave_order(order, event_ticks, event_notes, is_note_on,
+                                            deinterleave_keys(pitches, channels))
+
+        channels, pitches, durations, volumes, insertion_orders = [
+            column.tolist() for column in [channels, pitches, durations, volumes, insertion_orders]]
+        events = []
+        for event, tick in zip(order.tolist(), event_ticks[order].tolist()):
+            if event < count:
+                events.append(NoteOn(channels[event], pitches[event], tick, durations[event],
+                                     volumes[event], insertion_order=insertion_orders[event]))
+            else:
+                note = event - count
+                events.append(NoteOff(channels[note], pitches[note], tick, volumes[note],
+                                      insertion_order=insertion_orders[note]))
+        return events
+
+    @staticmethod
+    def deinterleave_order(order, event_ticks, event_notes, is_note_on, note_keys):
+        """
+        Deinterleave the sorted events as MIDITrack.deInterleaveNotes does: a NoteOff
+        with more than one NoteOn of its key sounding is moved to the start of the
+        latest one. event_ticks is updated in place. The moved NoteOffs only move earlier,
+        so they are merged back into the other events, which stay sorted.
+        """
+        stacks = {}
+        moved = []
+        for position, (key, tick, note_on) in enumerate(zip(note_keys[event_notes[order]].tolist(),
+                                                              event_ticks[order].tolist(),
+                                                              is_note_on[order].tolist())):
+            if note_on:
+                stacks.setdefault(key, []).append(tick)
+            else:
+                stack = stacks[key]
+                if len(stack) > 1:
+                    new_tick = stack.pop()
+                    if new_tick != tick:
+                        moved.append((position, new_tick))
+                else:
+                    stack.pop()
+        if not moved:
+            return order
+
+        # NoteOffs sort after each other by tick, then by insertion order (note index)
+        positions, new_ticks = [np.array(x, dtype=np.int64) for x in zip(*moved)]
+        moved_events = order[positions]
+        event_ticks[moved_events] = new_ticks
+        sort_keys = (event_ticks * 4 + np.where(is_note_on, NoteOn.sec_sort_order, NoteOff.sec_sort_order)) \
+                    * len(is_note_on) + event_notes
+        moved_events = moved_events[np.argsort(sort_keys[moved_events], kind='stable')]
+        kept_events = np.delete(order, positions)
+        return np.insert(kept_events, np.searchsorted(sort_keys[kept_events], sort_keys[moved_events]),
+                         moved_events)
+
+    @staticmethod
+    def merge_events(note_events, other_events):
+        """
+        Merge sorted note events and sorted other events by sort_events.
+        """
+        merged = []
+        start = 0
+        for event in other_events:
+            stop = bisect_left(note_events, sort_events(event), lo=start, key=sort_events)
+            merged.extend(note_events[start:stop])
+            merged.append(event)
+            start = stop
+        merged.extend(note_events[start:])
+        return merged
+
+
+class GridMIDIFile(MIDIFile):
+    """
+    MIDIFile whose notes are added as columns (addNotes) and ordered on the tick grid
+    at encode time (see GridMIDITrack). Writes the same bytes as MIDIFile with the same
+    notes added one by one with addNote.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tracks = [GridMIDITrack(track.remdep, track.deinterleave) for track in self.tracks]
+
+    def to_ticks(self, times):
+        """
+        Times (quarter notes or ticks, see MIDIFile) as an int64 array of ticks, rounded
+        as MIDIFile.time_to_ticks rounds.
+        """
+        times = np.asarray(times)
+        if self.eventtime_is_ticks:
+            return times.astype(np.int64)
+        if times.dtype.kind in 'iu':
+            return times.astype(np.int64) * self.ticks_per_quarternote
+        return (times.astype(np.float64) * self.ticks_per_quarternote).astype(np.int64)
+
+    def addNote(self, track, channel, pitch, time, duration, volume, annotation=None):
+        assert annotation is None, 'GridMIDIFile does not support note annotations'
+        self.addNotes(track, [channel], [pitch], [time], [duration], [volume])
+
+    def addNotes(self, track, channels, pitches, times, durations, volumes):
+        """
+        Add notes to a track from sequences of equal length (see MIDIFile.addNote). The
+        notes are inserted in order, as if added one by one.
+        """
+        if self.header.numeric_format == 1:
+            track += 1
+        count = len(times)
+        self.tracks[track].addNotes(
+            np.asarray(channels, dtype=np.int64),
+            np.asarray(pitches, dtype=np.int64),
+            self.to_ticks(times),
+            self.to_ticks(durations),
+            np.asarray(volumes, dtype=np.int64),
+            np.arange(self.event_counter, self.event_counter + count)
+        )
+        self.event_counter += count
+
+    def close(self):
+        # As MIDIFile.close, without sorting the closed tracks again
+        if self.closed:
+            return
+        for track in self.tracks:
+            track.closeTrack()
+        origin = self.findOrigin()
+        for track in self.tracks:
+            track.adjustTimeAndOrigin(origin, self.adjust_origin)
+            track.writeMIDIStream()
+        self.closed = True
+
+
+def benchmark(event_table, repeat=3):
+    """
+    Fastest times of writing event_table with MIDIFile (notes added one by one) and
+    GridMIDIFile (notes added per track as columns). Returns (MIDIFile seconds,
+    GridMIDIFile seconds, whether the bytes are equal).
+    """
+    table = event_table.table
+    num_tracks = int(table['track'].max()) + 1
+    columns = ['channel', 'pitch', 'start', 'duration', 'velocity']
+    results = []
+    for midi_file_type in [MIDIFile, GridMIDIFile]:
+        seconds = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            midi_file = midi_file_type(num_tracks)
+            if midi_file_type is MIDIFile:
+                for note in zip(*[table[name].tolist() for name in ['track'] + columns]):
+                    midi_file.addNote(*note)
+            else:
+                for track in range(num_tracks):
+                    notes = table[table['track'] == track]
+                    midi_file.addNotes(track, *[notes[name] for name in columns])
+            midi_bytes = io.BytesIO()
+            midi_file.writeFile(midi_bytes)
+            seconds.append(time.perf_counter() - start_time)
+        results.append((min(seconds), midi_bytes.getvalue()))
+    return results[0][0], results[1][0], results[0][1] == results[1][1]
+
+
+if __name__ == "__main__":
+
+    # python -m music.midifile [run() args]: time MIDIFile against GridMIDIFile on one song
+    from music.create_midi import run
+    arg_str_list = sys.argv[1:] or ['--seed', '1', '--gentype', '1', '--numpatterns', '60',
+                                    '--repeat', '16', '--length', '32']
+    event_table = run(arg_str_list, None)
+    midi_seconds, grid_seconds, equal = benchmark(event_table)
+    print(f'{len(event_table)} notes: MIDIFile {midi_seconds:.3f}s, GridMIDIFile {grid_seconds:.3f}s, '
+          f'speedup {midi_seconds / grid_seconds:.2f}x, same bytes: {equal}')
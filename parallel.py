@@ -0,0 +1,156 @@
+import io
+import os
+import sys
+import multiprocessing
+from collections import deque
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from music.events import EVENT_DTYPE
+from music.metrics import registry
+
+
+# Plan of the current worker process, set once by the pool initializer
+_worker_plan = None
+
+
+class SharedResult:
+    """
+    Handle to a song generated by a worker process. The song's events (EVENT_DTYPE
+    records) or MIDI bytes are stored in a shared memory block, so only this small
+    handle is pickled back to the parent.
+
+    Attributes:
+        name: str       Name of the shared memory block.
+        seed: int/str   Seed of the song.
+        payload: str    'events' or 'midi'.
+        count: int      Number of events ('events') or bytes ('midi').
+        args: dict      Generation arguments of the song.
+        collapsed: dict Notes collapsed by --normalize (see EventTable.collapse_notes), or None.
+        metrics: dict   Metric values recorded by the worker for the song (see Registry.drain), 
+                        merged into the parent's registry by generate_shared.
+    """
+    def __init__(self, name, seed, payload, count, args, collapsed=None, metrics=None):
+        self.name = name
+        self.seed = seed
+        self.payload = payload
+        self.count = count
+        self.args = args
+        self.collapsed = collapsed
+        self.metrics = metrics
+        self._shm = None
+
+    def open(self):
+        """
+        Attach to the shared memory block and return the data without copying: an
+        EVENT_DTYPE array for 'events', a memoryview of the bytes for 'midi'. The data
+        is valid until release() is called.
+        """
+        if self._shm is None:
+            self._shm = SharedMemory(name=self.name)
+        if self.payload == 'events':
+            return np.ndarray(self.count, dtype=EVENT_DTYPE, buffer=self._shm.buf)
+        return self._shm.buf[:self.count]
+
+    def release(self):
+        """
+        Detach from and free the shared memory block. Arrays and views returned by open()
+        must not be used afterwards.
+        """
+        if self._shm is None:
+            self._shm = SharedMemory(name=self.name)
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = None
+        return state
+
+
+def _init_worker(plan):
+    global _worker_plan
+    _worker_plan = plan
+    # A forked worker starts with a copy of the parent's metric values
+    registry.reset()
+
+
+def _create_shared_memory(size):
+    """
+    Create a shared memory block owned by the parent process: the worker's resource 
+    tracker must not unlink it when the worker exits, the parent unlinks it in 
+    SharedResult.release.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(create=True, size=size, track=False)
+    shm = SharedMemory(create=True, size=size)
+    if os.name == 'posix':
+        # POSIX blocks are tracked under their name with a leading slash
+        resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    return shm
+
+
+def _generate_shared(seed, payload):
+    """
+    Generate one song with the worker's plan and write it to a new shared memory block.
+    """
+    if payload == 'events':
+        event_table = _worker_plan.execute(seed)
+        count = len(event_table)
+        shm = _create_shared_memory(max(count * EVENT_DTYPE.itemsize, 1))
+        event_table.to_array(out=np.ndarray(count, dtype=EVENT_DTYPE, buffer=shm.buf))
+    else:
+        midi_bytes = io.BytesIO()
+        event_table = _worker_plan.execute(seed, filepath=midi_bytes)
+        count = midi_bytes.getbuffer().nbytes
+        shm = _create_shared_memory(max(count, 1))
+        shm.buf[:count] = midi_bytes.getbuffer()
+    shm.close()
+    return SharedResult(shm.name, seed, payload, count, event_table.args, event_table.collapsed,
+                        registry.drain())
+
+
+def _collect(job):
+    """
+    Wait for a song and merge the metrics its worker recorded into this process's registry.
+    """
+    result = job.get()
+    registry.merge(result.metrics)
+    return result
+
+
+def generate_shared(plan, seeds, processes=None, payload='events', window=None):
+    """
+    Generate one song per seed from a GenerationPlan in a process pool.
+
+    Yields a SharedResult for each song in the order of seeds. The workers write the
+    song's events or MIDI bytes (payload 'events' or 'midi') into shared memory, and the
+    caller reads them with result.open() and frees them with result.release().
+
+    At most window songs (default two per process) are submitted ahead of the song
+    being yielded, so finished blocks do not pile up in shared memory faster than the
+    caller releases them. Songs that were generated but not yielded, because the
+    generator was closed early or a song raised, are released before the pool exits.
+    The metrics recorded by the workers are merged into the registry of this process.
+    """
+    assert payload in ['events', 'midi'], "payload must be 'events' or 'midi'"
+    processes = processes if processes is not None else os.cpu_count()
+    window = window if window is not None else 2 * processes
+    pending = deque()
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(plan,)) as pool:
+        try:
+            for seed in seeds:
+                pending.append(pool.apply_async(_generate_shared, (seed, payload)))
+                if len(pending) >= window:
+                    yield _collect(pending.popleft())
+            while pending:
+                yield _collect(pending.popleft())
+        finally:
+            for job in pending:
+                try:
+                    _collect(job).release()
+                except Exception:
+                    pass
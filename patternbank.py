@@ -0,0 +1,117 @@
+import sys
+import copy
+import time
+import random
+from collections import OrderedDict
+
+from music.patterns import ScaleViews
+from music.create_midi import GenerationPlan
+
+
+class PatternBank:
+    """
+    Bank of initialized patterns shared by the songs of a batch.
+
+    Patterns are stored per (pattern class, key, scale notes, length, repeat, extra
+    constructor arguments). Each entry has up to variants initialized patterns. A request
+    draws a variant index with the global random module, so a song stays reproducible
+    from its seed, and the variant is generated the first time it is drawn, from a random
+    seed derived from the entry and the index, so the contents of an entry do not depend
+    on which songs were generated before. A request thus initializes at most one pattern,
+    as a song without a bank does, and later requests of a variant copy it. At most
+    max_entries entries are kept; the least recently used entry is evicted first. The
+    default leaves room for the distinct entries of a batch with random keys and
+    arguments (gentype 4 reaches about 2000).
+
+    Attributes:
+        max_entries: int    Maximum number of entries.
+        variants: int       Maximum number of patterns per entry.
+        entries: OrderedDict    Generated patterns of each entry by variant index, least 
+                                recently used entry first.
+        hits: int           Requests of a generated variant.
+        misses: int         Requests that generated a variant.
+    """
+    def __init__(self, max_entries=8192, variants=16):
+        self.max_entries = max_entries
+        self.variants = variants
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def generate(self, variant, pattern_type, key, scale, length, repeat, **kwargs):
+        """
+        Generate an initialized variant of an entry without touching the global random state.
+        """
+        random_state = random.getstate()
+        try:
+            random.seed(f'{pattern_type.__name__}:{key}:{tuple(scale)}:{length}:{repeat}:{sorted(kwargs.items())}:{variant}')
+            pattern = pattern_type(key, scale if isinstance(scale, ScaleViews) else list(scale), 
+                                   length, repeat, **kwargs)
+            pattern.initialize()
+        finally:
+            random.setstate(random_state)
+        return pattern
+
+    def sample(self, pattern_type, key, scale, length, repeat, **kwargs):
+        """
+        Return a copy of a random variant of an entry (see pattern_type.__init__ for the
+        arguments), generating the variant first if it is not in the bank. The scale may be
+        a list of notes or a ScaleViews.
+        """
+        notes = scale.key if isinstance(scale, ScaleViews) else tuple(scale)
+        entry = (pattern_type, key, notes, length, repeat, tuple(sorted(kwargs.items())))
+        variant = random.randrange(self.variants)
+        patterns = self.entries.get(entry)
+        if patterns is None:
+            patterns = self.entries[entry] = {}
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(entry)
+        pattern = patterns.get(variant)
+        if pattern is None:
+            self.misses += 1
+            pattern = patterns[variant] = self.generate(variant, pattern_type, key, scale, length, repeat, **kwargs)
+        else:
+            self.hits += 1
+
+        # Copy the note lists too, since songs modify patterns in place
+        pattern = copy.copy(pattern)
+        for name, value in vars(pattern).items():
+            if isinstance(value, list):
+                setattr(pattern, name, list(value))
+        return pattern
+
+
+def benchmark(arg_str_list, seeds, pattern_bank=None):
+    """
+    Seconds taken to generate one song per seed with the given arguments, sampling the
+    patterns from pattern_bank if one is given.
+    """
+    plan = GenerationPlan(arg_str_list, pattern_bank=pattern_bank)
+    start_time = time.perf_counter()
+    for seed in seeds:
+        plan.execute(str(seed))
+    return time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+
+    # python -m music.patternbank [songs [run() args]]: time batches of songs without a
+    # bank, with a new bank and with the same bank again on new seeds
+    songs = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    arg_str_list = sys.argv[2:] or ['--gentype', '1']
+    benchmark(arg_str_list, ['warmup'])
+    pattern_bank = PatternBank()
+    for name, seeds, bank in [('without bank', range(songs), None),
+                              ('new bank', range(songs), pattern_bank),
+                              ('without bank', range(songs, 2 * songs), None),
+                              ('warm bank', range(songs, 2 * songs), pattern_bank)]:
+        hits, misses = pattern_bank.hits, pattern_bank.misses
+        seconds = benchmark(arg_str_list, seeds, bank)
+        print(f'{name}, seeds {seeds.start}-{seeds.stop - 1}: {seconds:.2f}s'
+              + (f' ({pattern_bank.hits - hits} hits, {pattern_bank.misses - misses} misses)' if bank else ''))
+    print(f'{len(pattern_bank)} entries')
@@ -1,9 +1,155 @@
 import random
 import warnings
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate
+import numpy as np
 from numpy import exp
 from scipy.stats import norm
 from abc import ABC, abstractmethod
 
+from music.pitchset import PitchSet, num_notes
+from music.voiceleading import chord_pitch_classes, voice_lead
+
+
+def default_rng():
+    """
+    NumPy random generator for the batch samplers, seeded from the random module so that 
+    random.seed also makes batch sampling reproducible.
+    """
+    return np.random.default_rng(random.getrandbits(64))
+
+
+def batch_sample_markov_chains(k, length, initial, transitions, rng=None):
+    """
+    Sample k Markov chains of length states each: return a (k, length) int array. 
+    Initial holds the weights of the first state and row i of transitions the weights of 
+    the state following state i. The rows are tabulated once as cumulative weights, so 
+    each step is one vectorized draw for all k chains.
+    """
+    rng = rng if rng is not None else default_rng()
+    initial_cum_weights = np.cumsum(initial)
+    cum_weights = np.cumsum(transitions, axis=1)
+    assert initial_cum_weights[-1] > 0 and np.all(cum_weights[:, -1] > 0), 'weights must not be all zero'
+    states = np.empty((k, length), dtype=np.int64)
+    if length == 0:
+        return states
+    states[:, 0] = np.searchsorted(initial_cum_weights, rng.random(k) * initial_cum_weights[-1], side='right')
+    for i in range(1, length):
+        row_cum_weights = cum_weights[states[:, i-1]]
+        targets = rng.random(k) * row_cum_weights[:, -1]
+        states[:, i] = (row_cum_weights <= targets[:, None]).sum(axis=1)
+    return states
+
+
+@lru_cache(maxsize=None)
+def accent_cum_weights(pattern_type, length, rigidity):
+    """
+    Cumulative onset weights over range(length) for a drum pattern type.
+
+    Steps i with i % pattern_type.accent_period == pattern_type.accent_offset get a weight 
+    that grows with rigidity, other steps a weight of 1 (or 0 if rigidity is 1.0). The 
+    result is cached per (pattern type, length, rigidity) since the same table is needed 
+    for every pattern, section and song.
+    """
+    high_weight = rigidity * pattern_type.accent_weight if rigidity > 0.0 else 1
+    low_weight = 1 if rigidity < 1.0 else 0
+    period, offset = pattern_type.accent_period, pattern_type.accent_offset
+    note_weights = [high_weight if i % period == offset else low_weight for i in range(length)]
+    return tuple(accumulate(note_weights))
+
+
+class RegisterView:
+    """
+    Notes of a scale within a register.
+
+    Attributes:
+        notes: list         Notes of the scale in the register, in scale order.
+        index: dict         Index of the first occurrence of each note in notes.
+    """
+    def __init__(self, notes):
+        self.notes = notes
+        self.index = {}
+        for i, note in enumerate(notes):
+            self.index.setdefault(note, i)
+
+
+@lru_cache(maxsize=4096)
+def register_view(scale, low=None, high=None, pitch_class=None):
+    """
+    RegisterView of the notes x of scale (a tuple) with low <= x <= high (None: no bound)
+    and, if pitch_class is given, x % 12 == pitch_class.
+
+    A scale that is a set of MIDI notes in ascending order (e.g. Scale.all_scale_notes) 
+    is intersected with the register as a PitchSet. Other ascending scales (modulated 
+    past 0-127) are sliced with bisect, and chord note lists, which need not be 
+    ascending, are filtered. The views are cached per (scale, register), so the patterns 
+    of a song (and of later songs in the same key) share them instead of re-filtering the 
+    scale each time a melody is generated. The views are shared: do not modify them.
+    """
+    pitch_set = PitchSet(scale)
+    if len(pitch_set) == len(scale) and list(pitch_set) == list(scale):
+        register = pitch_set.register(low if low is not None else 0, high + 1 if high is not None else num_notes)
+        if pitch_class is not None:
+            register &= PitchSet.from_pitch_classes([pitch_class])
+        return RegisterView(list(register))
+    if all(x <= y for x, y in zip(scale, scale[1:])):
+        start = bisect_left(scale, low) if low is not None else 0
+        stop = bisect_right(scale, high) if high is not None else len(scale)
+        notes = list(scale[start:stop])
+    else:
+        notes = [x for x in scale if (low is None or low <= x) and (high is None or x <= high)]
+    if pitch_class is not None:
+        notes = [x for x in notes if x % 12 == pitch_class]
+    return RegisterView(notes)
+
+
+class ScaleViews:
+    """
+    Notes of a scale together with the register views of it that patterns request.
+
+    A ScaleViews is created once per scale (Scale.views) or chord (ChordProgression.
+    chord_progression_views) and passed to every pattern built on it, so a register is 
+    sliced once per scale rather than once per pattern, and the lookups need no hashing 
+    of the note list. The views are shared: do not modify them.
+
+    Attributes:
+        notes: list         Notes of the scale.
+        key: tuple          Notes of the scale as a tuple.
+        views: dict         RegisterView of each (low, high, pitch_class) requested so far.
+        transposed: dict    ScaleViews of the scale transposed by each shift requested so far.
+    """
+    def __init__(self, notes):
+        self.notes = list(notes)
+        self.key = tuple(self.notes)
+        self.views = {}
+        self.transposed = {}
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __iter__(self):
+        return iter(self.notes)
+
+    def register(self, low=None, high=None, pitch_class=None):
+        """
+        RegisterView of the notes between low and high (inclusive, see register_view).
+        """
+        register = (low, high, pitch_class)
+        view = self.views.get(register)
+        if view is None:
+            view = self.views[register] = register_view(self.key, low, high, pitch_class)
+        return view
+
+    def transpose(self, shift):
+        """
+        ScaleViews of the notes transposed by shift semitones.
+        """
+        views = self.transposed.get(shift)
+        if views is None:
+            views = self.transposed[shift] = ScaleViews([note + shift for note in self.notes])
+        return views
+
 
 class Scale:
     """
@@ -18,7 +164,9 @@ class Scale:
         mode_idx: int
         mode_name: str
         names: list[str]
+        pitch_set: PitchSet
         all_scale_notes: list[int]
+        views: ScaleViews       Views of all_scale_notes, passed to the patterns of the scale.
     """
 
     scale_types = {
@@ -71,9 +219,11 @@ class Scale:
         scale = [(note + self.key) % 12 for note in mode]
         self.names = [Scale.note_names[note] for note in scale]
         if limit_range:
-            self.all_scale_notes = [i for i in range(23, 97) if (i % 12) in scale]
+            self.pitch_set = PitchSet.from_pitch_classes(scale, 23, 97)
         else:
-            self.all_scale_notes = [i for i in range(128) if (i % 12) in scale]
+            self.pitch_set = PitchSet.from_pitch_classes(scale)
+        self.all_scale_notes = list(self.pitch_set)
+        self.views = ScaleViews(self.all_scale_notes)
 
 
 class ChordProgression:
@@ -101,9 +251,27 @@ class ChordProgression:
 
     chord_progression_notes: list(list(int))  A list containing a list of allowed notes for each chord.
 
+    chord_progression_views: list(ScaleViews)  ScaleViews of each chord, passed to the patterns of the chord.
+
     allow_outside: bool       Whether to allow chords in the progression that are based on notes 
                               outside of the given scale.
 
+    voice_leading: bool       If True, each chord is realized as one voicing in voice_leading_range 
+                              (default key + 48 ... key + 72) chosen for the least voice movement 
+                              through the progression (see voiceleading.voice_lead). The chord notes 
+                              are the notes of the chord below the range plus the realized voicing.
+
+    voiced_chords: list(tuple(int))  Realized voicing of each chord if voice_leading, else None.
+
+    degree_transitions: array  If given, scale degrees follow a Markov chain: row i holds the weights 
+                              of the degree after degree i (see default_degree_transitions).
+
+    voicing_transitions: array If given (and voicing is not), voicings follow a Markov chain over 
+                              basic_voicings in order: row i holds the weights of the voicing after 
+                              voicing i (see default_voicing_transitions).
+
+    The scale degrees and voicing list may also be given directly, e.g. from batch_sample.
+
     """
     
     basic_voicings = {
@@ -119,7 +287,69 @@ class ChordProgression:
         '7no3':     [0, 4, 6]
     }
 
-    def __init__(self, scale, length=8, repeat=4, voicing=None, allow_outside=None):
+    @staticmethod
+    def default_degree_transitions(scale_length):
+        """
+        Degree transition weights equivalent to sampling each degree independently: the 
+        seventh degree is never chosen in seven-note scales, other degrees equally often.
+        """
+        weights = [5,5,5,5,5,5,0] if scale_length == 7 else [1] * scale_length
+        return np.tile(np.array(weights, dtype=float), (scale_length, 1))
+
+    @classmethod
+    def default_voicing_transitions(cls):
+        """
+        Voicing transition weights equivalent to choosing each voicing independently.
+        """
+        return np.ones((len(cls.basic_voicings), len(cls.basic_voicings)))
+
+    @staticmethod
+    def initial_weights(transitions):
+        """
+        Weights of the first state of a chain: the mean of the transition rows, which is 
+        the weights of every step for the default (independent) transitions.
+        """
+        transitions = np.asarray(transitions, dtype=float)
+        assert np.all(transitions.sum(axis=1) > 0), 'weights must not be all zero'
+        return (transitions / transitions.sum(axis=1, keepdims=True)).mean(axis=0)
+
+    @staticmethod
+    def sample_chain(length, transitions):
+        """
+        Sample one Markov chain of length states with the random module.
+        """
+        transitions = np.asarray(transitions, dtype=float)
+        states = range(len(transitions))
+        chain = []
+        weights = ChordProgression.initial_weights(transitions)
+        for _ in range(length):
+            chain.append(random.choices(states, weights=weights, k=1)[0])
+            weights = transitions[chain[-1]]
+        return chain
+
+    @classmethod
+    def batch_sample(cls, k, length=8, scale_length=7, degree_transitions=None, voicing_transitions=None,
+                     rng=None):
+        """
+        Sample k progressions at once: return (scale_degrees, voicing_idxs), two (k, length) 
+        int arrays. Voicing_idxs index list(basic_voicings.values()). A progression is 
+        realized with ChordProgression(scale, length, scale_degrees=list(scale_degrees[i]), 
+        voicing_list=[voicings[j] for j in voicing_idxs[i]]).
+        """
+        if degree_transitions is None:
+            degree_transitions = cls.default_degree_transitions(scale_length)
+        if voicing_transitions is None:
+            voicing_transitions = cls.default_voicing_transitions()
+        rng = rng if rng is not None else default_rng()
+        scale_degrees = batch_sample_markov_chains(k, length, cls.initial_weights(degree_transitions), 
+                                                   degree_transitions, rng)
+        voicing_idxs = batch_sample_markov_chains(k, length, cls.initial_weights(voicing_transitions), 
+                                                  voicing_transitions, rng)
+        return scale_degrees, voicing_idxs
+
+    def __init__(self, scale, length=8, repeat=4, voicing=None, allow_outside=None, voice_leading=False,
+                 voice_leading_range=None, degree_transitions=None, voicing_transitions=None,
+                 scale_degrees=None, voicing_list=None):
 
         if scale.scale_type_name != 'major':
             warnings.warn('voicings do not correspond to scale degrees properly with non-diatonic scales')
@@ -132,7 +362,12 @@ class ChordProgression:
         self.repeat = repeat
         self.total_length = length * repeat
         self.scale_length = len(self.scale.scale_type)
-        if len(scale.scale_type) == 7:
+        if scale_degrees is not None:
+            assert len(scale_degrees) == length, 'scale_degrees must have length items'
+            self.scale_degrees = [int(x) for x in scale_degrees]
+        elif degree_transitions is not None:
+            self.scale_degrees = self.sample_chain(length, degree_transitions)
+        elif len(scale.scale_type) == 7:
             self.scale_degrees = random.choices(range(self.scale_length), 
                                                 weights=[5,5,5,5,5,5,0],
                                                 k=length)
@@ -140,12 +375,19 @@ class ChordProgression:
             self.scale_degrees = random.choices(range(self.scale_length), k=length)
         self.voicing_list = None
         self.chord_progression_notes = None
+        self.chord_progression_views = None
 
         if allow_outside is not None:
             raise NotImplementedError
         # self.allow_outside = allow_outside if allow_outside is not None else random.choice([True, False])
 
-        if voicing is None: 
+        if voicing_list is not None:
+            assert len(voicing_list) == length, 'voicing_list must have length items'
+            self.voicing_list = [list(x) for x in voicing_list]
+        elif voicing is None and voicing_transitions is not None:
+            voicings = list(self.basic_voicings.values())
+            self.voicing_list = [voicings[i] for i in self.sample_chain(self.length, voicing_transitions)]
+        elif voicing is None: 
             self.voicing_list = [random.choice(list(self.basic_voicings.values())) for _ in range(self.length)]
         else:
             if voicing in self.basic_voicings:
@@ -165,11 +407,11 @@ class ChordProgression:
             for octave in range(8):
                 all_chord_idxs.extend([note + self.scale_length*octave for note in current_voicing])
 
-            scale_idxs = range(len(scale.all_scale_notes))
             scale_degree_note = (scale.key + scale.mode[scale_degree]) % 12
-            scale_degree_first_idx = [x % 12 for x in scale.all_scale_notes].index(scale_degree_note)
-            offset_idxs = [i - scale_degree_first_idx for i in scale_idxs]
-            offset_chord_idxs = [offset_idxs.index(note) for note in all_chord_idxs if note in offset_idxs]
+            scale_degree_first_note = (scale.pitch_set & PitchSet.from_pitch_classes([scale_degree_note])).lowest()
+            scale_degree_first_idx = scale.pitch_set.rank(scale_degree_first_note)
+            offset_chord_idxs = [note + scale_degree_first_idx for note in all_chord_idxs 
+                                 if note + scale_degree_first_idx < len(scale.all_scale_notes)]
 
             all_chord_notes = []
             for i, idx in enumerate(offset_chord_idxs):
@@ -185,7 +427,73 @@ class ChordProgression:
 
             chord_progression_notes.append(all_chord_notes)
 
+        self.voiced_chords = None
+        if voice_leading:
+            if voice_leading_range is None:
+                voice_leading_range = range(scale.key + 48, scale.key + 73)
+            low, high = voice_leading_range.start, voice_leading_range.stop
+            chords = [chord_pitch_classes(scale.key, tuple(scale.mode), scale_degree, tuple(current_voicing))
+                      for scale_degree, current_voicing in zip(self.scale_degrees, self.voicing_list)]
+            self.voiced_chords = voice_lead(chords, low, high)
+            chord_progression_notes = [[x for x in notes if x < low] + list(voiced)
+                                       for notes, voiced in zip(chord_progression_notes, self.voiced_chords)]
+
         self.chord_progression_notes = chord_progression_notes * repeat
+        self.chord_progression_views = [ScaleViews(notes) for notes in chord_progression_notes] * repeat
+
+
+class ProgressionSampler:
+    """
+    Chord progressions for the songs of a batch, sampled in blocks with 
+    ChordProgression.batch_sample instead of one Markov chain per song.
+
+    A block of block_size progressions is sampled per (length, scale length) the first 
+    time it is needed, from a NumPy generator seeded with the length, scale length and 
+    seed, so the blocks do not depend on which songs were generated before or in which 
+    process. A song draws one row of the block with the global random module, so it 
+    stays reproducible from its seed.
+
+    Attributes:
+        degree_transitions: array   Scale degree transition weights, default 
+                                    ChordProgression.default_degree_transitions.
+        voicing_transitions: array  Voicing transition weights, default 
+                                    ChordProgression.default_voicing_transitions.
+        block_size: int             Number of progressions per block.
+        seed: int                   Seed of the blocks.
+        blocks: dict[tuple, tuple]  (scale degrees, voicing indices) arrays per (length, scale length).
+    """
+    def __init__(self, degree_transitions=None, voicing_transitions=None, block_size=65536, seed=0):
+        self.degree_transitions = degree_transitions
+        self.voicing_transitions = voicing_transitions
+        self.block_size = block_size
+        self.seed = seed
+        self.blocks = {}
+
+    def block(self, length, scale_length):
+        """
+        The (scale degrees, voicing indices) block of a length and scale length.
+        """
+        if (length, scale_length) not in self.blocks:
+            assert self.degree_transitions is None or len(self.degree_transitions) == scale_length, \
+                'degree_transitions must have a row per scale degree'
+            rng = np.random.default_rng([length, scale_length, self.seed])
+            scale_degrees, voicing_idxs = ChordProgression.batch_sample(
+                self.block_size, length, scale_length, self.degree_transitions, self.voicing_transitions, rng)
+            self.blocks[length, scale_length] = (scale_degrees.astype(np.int8), voicing_idxs.astype(np.int8))
+        return self.blocks[length, scale_length]
+
+    def sample(self, length, scale_length, voicing=None):
+        """
+        Return the ChordProgression arguments (scale_degrees and, unless voicing is 
+        given, voicing_list) of a random progression of the block.
+        """
+        scale_degrees, voicing_idxs = self.block(length, scale_length)
+        row = random.randrange(self.block_size)
+        progression = {'scale_degrees': scale_degrees[row].tolist()}
+        if voicing is None:
+            voicings = list(ChordProgression.basic_voicings.values())
+            progression['voicing_list'] = [voicings[i] for i in voicing_idxs[row].tolist()]
+        return progression
 
 
 class Pattern(ABC):
@@ -194,12 +502,15 @@ class Pattern(ABC):
 
     SUbclasses must override methods 'generate_melody' and 'generate_rhythm'.
 
+    The scale may be given as a list of notes or as a ScaleViews shared with other 
+    patterns (e.g. Scale.views); self.scale is the list of notes and self.views its views.
+
     # TODO: docs for attributes
     """
     def __init__(self, key, scale, length=None, repeat=None, rigidity=0.5):
         self.key = key
         self.scale = scale
-        self.allowed_range = range(23,97)
+        self.allowed_range = PitchSet.from_range(23, 97)
         self.length = length if length is not None else random.randint(1, 16)
         self.repeat = repeat if repeat is not None else random.randint(2, 8)
         self.rigidity = rigidity
@@ -209,9 +520,18 @@ class Pattern(ABC):
         self.start_times = None
         self.durations = None
         self.volumes = None
+        self.volume_limit = None
         self.root_note = None
         self.percussion_pattern_types = [PercussionSingle, BassDrum, Snare, Cymbals, AccentCymbals]
 
+    @property
+    def scale(self):
+        return self.views.notes
+
+    @scale.setter
+    def scale(self, scale):
+        self.views = scale if isinstance(scale, ScaleViews) else ScaleViews(scale)
+
     @abstractmethod
     def generate_rhythm(self):
         """
@@ -238,6 +558,60 @@ class Pattern(ABC):
                     volumes[i] = 70
         self.volumes = volumes
 
+    def batch_generate_volumes(self, k, notes=None, rng=None):
+        """
+        Batch form of generate_volumes: return a (k, note_amount*repeat) array with the 
+        volumes of k variations. Notes is a (k, n) array of the pitches of each variation 
+        (default self.notes for all) used for limiting the volumes of high notes.
+        """
+        rng = rng if rng is not None else default_rng()
+        volumes = rng.integers(70, 110, size=(k, self.note_amount*self.repeat))
+        if self.__class__ not in self.percussion_pattern_types:
+            notes = np.asarray(notes if notes is not None else self.notes)
+            notes = np.broadcast_to(notes, (k, notes.shape[-1]))[:, :volumes.shape[1]]
+            limited = volumes[:, :notes.shape[1]]
+            limited[(notes > 72) & (limited > 70)] = 70
+        return volumes
+
+    def batch_generate_rhythm(self, k, rng=None):
+        """
+        Batch form of generate_rhythm: return a (k, len(self.start_times)) array of start 
+        times relative to the start of the pattern, one row per variation. Pattern types 
+        without a batch rhythm keep their current rhythm in every row.
+        """
+        offset = (self.start_times[0] // self.total_length) * self.total_length
+        return np.broadcast_to(np.array(self.start_times) - offset, (k, len(self.start_times)))
+
+    def batch_generate_melody(self, k, rng=None):
+        """
+        Batch form of generate_melody: return a (k, len(self.notes)) array of pitches. 
+        Pattern types without a batch melody keep their current notes in every row.
+        """
+        return np.broadcast_to(np.array(self.notes), (k, len(self.notes)))
+
+    def batch_repeat_rhythm(self, start_times):
+        """
+        Batch form of repeat_rhythm: repeat each row of a (k, n) array of start times.
+        """
+        repeats = self.length * np.arange(self.repeat)
+        return (start_times[:, None, :] + repeats[None, :, None]).reshape(len(start_times), -1)
+
+    def batch_variations(self, k, rng=None):
+        """
+        Sample k variations of an initialized pattern with the batch samplers. Returns 
+        (start_times, notes, volumes), (k, len(self.notes)) arrays with the start times 
+        relative to the start of the pattern. The note amount and durations are kept, and 
+        the volumes are limited to self.volume_limit if it is set.
+        """
+        rng = rng if rng is not None else default_rng()
+        start_times = self.batch_generate_rhythm(k, rng)
+        notes = self.batch_generate_melody(k, rng)
+        volumes = self.batch_generate_volumes(k, notes, rng)
+        if self.volume_limit is not None:
+            volumes = np.minimum(volumes, self.volume_limit)
+        n = len(self.notes)
+        return start_times[:, :n], notes[:, :n], volumes[:, :n]
+
     def initialize(self):
         """
         Initialize pattern by generating rhythm, pitch and volume information.
@@ -250,11 +624,7 @@ class Pattern(ABC):
         """
         Helper function for repeating the created rhythm.
         """
-        start_times_repeat = []
-        for i in range(self.repeat):
-            for s in start_times:
-                start_times_repeat.append(s + i*self.length)
-        self.start_times = start_times_repeat
+        self.start_times = [s + i*self.length for i in range(self.repeat) for s in start_times]
         self.durations = durations * self.repeat
     
     def regenerate_rhythm(self):
@@ -298,20 +668,20 @@ class Pattern(ABC):
         Modulate all notes of self.notes by 'shift' amount of semitones. 
         
         Does nothing if at least one modulated note ends up out of the allowed range. 
-        Shift may be positive or negative. 
+        Shift may be positive or negative. The new scale is returned as ScaleViews, 
+        shared by the patterns of the same scale.
         """
         assert self.notes is not None, 'Pattern has not been initialized'
         if self.__class__  in self.percussion_pattern_types:
-            return True, self.notes, self.key, self.scale
+            return True, self.notes, self.key, self.views
         
         new_notes = [note + shift for note in self.notes if note + shift in self.allowed_range]
 
         if len(new_notes) == len(self.notes):
             new_key = (self.key + shift) % 12
-            new_scale = [note + shift for note in self.scale]
-            return True, new_notes, new_key, new_scale
+            return True, new_notes, new_key, self.views.transpose(shift)
         else:
-            return False, self.notes, self.key, self.scale
+            return False, self.notes, self.key, self.views
 
     def diatonic_modulate(self, shift):
         """
@@ -333,6 +703,12 @@ class Pattern(ABC):
         else:
             return False, self.notes
 
+    def register(self, low=None, high=None, pitch_class=None):
+        """
+        RegisterView of self.scale between low and high (inclusive, see ScaleViews.register).
+        """
+        return self.views.register(low, high, pitch_class)
+
     def sample_notes(self, note_amount, all_notes, std_dev=6):
         """
         Sample note_amount notes from all_notes using a gaussian jumping distribution
@@ -344,21 +720,77 @@ class Pattern(ABC):
             note_weights = [normal_distr.pdf(x) for x in all_notes]
             notes.append(random.choices(all_notes, weights=note_weights, k=1)[0])
         return notes
+
+    def batch_sample_notes(self, k, note_amount, all_notes, std_dev=6, rng=None):
+        """
+        Batch form of sample_notes: return a (k, note_amount) array of k independently 
+        sampled note sequences. The jumping distribution is tabulated once as cumulative 
+        weights from each note of all_notes, so each step is one vectorized draw for all k.
+        """
+        rng = rng if rng is not None else default_rng()
+        all_notes = np.asarray(all_notes)
+        cum_weights = np.cumsum(norm.pdf(all_notes[None, :], all_notes[:, None], std_dev), axis=1)
+        idxs = np.empty((k, note_amount), dtype=np.int64)
+        idxs[:, 0] = rng.integers(len(all_notes), size=k)
+        for i in range(1, note_amount):
+            row_cum_weights = cum_weights[idxs[:, i-1]]
+            targets = rng.random(k) * row_cum_weights[:, -1]
+            idxs[:, i] = (row_cum_weights <= targets[:, None]).sum(axis=1)
+        return all_notes[np.minimum(idxs, len(all_notes) - 1)]
+
+    def sample_accented_onsets(self):
+        """
+        Sample self.note_amount sorted onsets in range(self.length), weighted towards the 
+        accented steps of the pattern type (see accent_cum_weights).
+        """
+        cum_weights = accent_cum_weights(self.__class__, self.length, self.rigidity)
+        return sorted(random.choices(range(self.length), cum_weights=cum_weights, k=self.note_amount))
    
-    def sample_arpeggio_notes(self, all_notes, root_note):
+    def batch_sample_accented_onsets(self, k, rng=None):
+        """
+        Batch form of sample_accented_onsets: return a (k, note_amount) array of sorted 
+        onsets, one row per variation.
         """
-        Sample notes from an arpeggio-type note distribution.
+        rng = rng if rng is not None else default_rng()
+        cum_weights = np.array(accent_cum_weights(self.__class__, self.length, self.rigidity))
+        targets = rng.random((k, self.note_amount)) * cum_weights[-1]
+        return np.sort(np.searchsorted(cum_weights, targets, side='right'), axis=1)
+
+    def sample_arpeggio_notes(self, all_notes, root_note, index=None):
+        """
+        Sample notes from an arpeggio-type note distribution. Index maps each note to its 
+        first index in all_notes (see RegisterView) and is built if not given.
         
         TODO (notes rising in thirds from the root note).
         """
-        while root_note not in all_notes:
+        index = index if index is not None else RegisterView(all_notes).index
+        while root_note not in index:
             root_note += 12
             if root_note > 127:
                 root_note = random.choice(all_notes[:5])
-        idx = all_notes.index(root_note)
+        idx = index[root_note]
         notes = random.choices(all_notes[idx::2], k=self.note_amount)
         return notes
 
+    def batch_sample_arpeggio_notes(self, k, all_notes, root_note, rng=None, index=None):
+        """
+        Batch form of sample_arpeggio_notes: return a (k, note_amount) array of k 
+        independently sampled arpeggios. If root_note has no octave in all_notes, each 
+        variation falls back to its own random root among the first 5 notes.
+        """
+        rng = rng if rng is not None else default_rng()
+        index = index if index is not None else RegisterView(all_notes).index
+        while root_note not in index and root_note <= 127:
+            root_note += 12
+        if root_note <= 127:
+            first_idxs = np.full(k, index[root_note])
+        else:
+            first_idxs = rng.integers(min(5, len(all_notes)), size=k)
+        # Number of notes in all_notes[first_idx::2]
+        choice_amounts = (len(all_notes) - first_idxs + 1) // 2
+        steps = (rng.random((k, self.note_amount)) * choice_amounts[:, None]).astype(np.int64)
+        return np.asarray(all_notes)[first_idxs[:, None] + 2*steps]
+
 
 class Percussion(Pattern, ABC):
     """
@@ -399,26 +831,31 @@ class PercussionSingle(Pattern):
         allowed_range = range(60, 71)
         self.notes = random.choices(allowed_range, k=1) * self.note_amount * self.repeat
 
+    def batch_generate_rhythm(self, k, rng=None):
+        rng = rng if rng is not None else default_rng()
+        start_times = np.sort(rng.integers(self.length, size=(k, self.note_amount)), axis=1)
+        return self.batch_repeat_rhythm(start_times)
+
+    def batch_generate_melody(self, k, rng=None):
+        rng = rng if rng is not None else default_rng()
+        return np.tile(rng.integers(60, 71, size=(k, 1)), self.note_amount * self.repeat)
+
 
 class Cymbals(Pattern):
     """
     Cymbal pattern with no accent/crash cymbals. Each note in the pattern is the same sound/instrument.
     """
+    accent_period = 2
+    accent_offset = 0
+    accent_weight = 20
+
     def __init__(self, key, scale, length=None, repeat=None, note_amount=None, rigidity=0.5):
         super().__init__(key, scale, length, repeat)
         self.note_amount = note_amount if note_amount is not None else random.randint(1, self.length)
         self.rigidity = rigidity
 
     def generate_rhythm(self):
-        high_weight = self.rigidity * 20 if self.rigidity > 0.0 else 1
-        low_weight = 1 if self.rigidity < 1.0 else 0
-        note_weights = []
-        for i in range(self.length):
-            if i % 2 == 0:
-                note_weights.append(high_weight)
-            else:
-                note_weights.append(low_weight)
-        start_times = sorted(random.choices(range(self.length), k=self.note_amount, weights=note_weights))
+        start_times = self.sample_accented_onsets()
         durations = [1] * self.note_amount
         self.repeat_rhythm(start_times, durations)
 
@@ -426,58 +863,64 @@ class Cymbals(Pattern):
         allowed_range = [42,44,46,51,53,59]
         self.notes = random.choices(allowed_range, k=1) * self.note_amount * self.repeat
 
+    def batch_generate_rhythm(self, k, rng=None):
+        return self.batch_repeat_rhythm(self.batch_sample_accented_onsets(k, rng))
+
+    def batch_generate_melody(self, k, rng=None):
+        rng = rng if rng is not None else default_rng()
+        allowed_range = np.array([42,44,46,51,53,59])
+        return np.tile(allowed_range[rng.integers(len(allowed_range), size=(k, 1))], self.note_amount * self.repeat)
+
 
 class BassDrum(Pattern):
     """
     Bass drum pattern. Rhythm heavily weighted on quarter notes.
     """
+    accent_period = 4
+    accent_offset = 0
+    accent_weight = 50
+
     def __init__(self, key, scale, length=None, repeat=None, note_amount=None, rigidity=0.5):
         super().__init__(key, scale, length, repeat)
         self.note_amount = note_amount if note_amount is not None else random.randint(1, self.length // 2)
         self.rigidity = rigidity
 
     def generate_rhythm(self):
-        high_weight = self.rigidity * 50 if self.rigidity > 0.0 else 1
-        low_weight = 1 if self.rigidity < 1.0 else 0
-        note_weights = []
-        for i in range(self.length):
-            if i % 4 == 0:
-                note_weights.append(high_weight)
-            else:
-                note_weights.append(low_weight)
-        start_times = sorted(random.choices(range(self.length), k=self.note_amount, weights=note_weights))
+        start_times = self.sample_accented_onsets()
         durations = [1] * self.note_amount
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self):
         self.notes = [35] * self.note_amount * self.repeat
 
+    def batch_generate_rhythm(self, k, rng=None):
+        return self.batch_repeat_rhythm(self.batch_sample_accented_onsets(k, rng))
+
 
 class Snare(Pattern):
     """
     Snare drum pattern. Rhythm heavily weighted on quarter notes 2 and 4 (where applicable).
     """
+    accent_period = 8
+    accent_offset = 4
+    accent_weight = 70
+
     def __init__(self, key, scale, length=None, repeat=None, note_amount=None, rigidity=0.5):
         super().__init__(key, scale, length, repeat)
         self.note_amount = note_amount if note_amount is not None else random.randint(1, max(1, self.length // 3))
         self.rigidity = rigidity
 
     def generate_rhythm(self):
-        high_weight = self.rigidity * 70 if self.rigidity > 0.0 else 1
-        low_weight = 1 if self.rigidity < 1.0 else 0
-        note_weights = []
-        for i in range(self.length):
-            if i % 8 == 4:
-                note_weights.append(high_weight)
-            else:
-                note_weights.append(low_weight)
-        start_times = sorted(random.choices(range(self.length), k=self.note_amount, weights=note_weights))
+        start_times = self.sample_accented_onsets()
         durations = [1] * self.note_amount
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self):
         self.notes = [40] * self.note_amount * self.repeat
 
+    def batch_generate_rhythm(self, k, rng=None):
+        return self.batch_repeat_rhythm(self.batch_sample_accented_onsets(k, rng))
+
 
 class AccentCymbals(Pattern):
     """
@@ -487,7 +930,8 @@ class AccentCymbals(Pattern):
     def __init__(self, key, scale, length=None, repeat=None, note_amount=None, play_each_repeat=False, rigidity=0.5):
         super().__init__(key, scale, length, repeat)
         self.note_amount = 1
-        self.allowed_range = [49,52,55,57]
+        self.cymbal_notes = [49,52,55,57]
+        self.allowed_range = PitchSet(self.cymbal_notes)
         self.play_each_repeat = play_each_repeat
 
     def generate_rhythm(self):
@@ -497,10 +941,15 @@ class AccentCymbals(Pattern):
             self.repeat_rhythm(self.start_times, self.durations)
 
     def generate_melody(self):
-        self.notes = random.choices(self.allowed_range, k=1) * self.note_amount
+        self.notes = random.choices(self.cymbal_notes, k=1) * self.note_amount
         if self.play_each_repeat:
             self.notes = self.notes * self.repeat
 
+    def batch_generate_melody(self, k, rng=None):
+        rng = rng if rng is not None else default_rng()
+        cymbal_notes = np.array(self.cymbal_notes)
+        return np.tile(cymbal_notes[rng.integers(len(cymbal_notes), size=(k, 1))], len(self.notes))
+
 
 class Bass(Pattern):
     """
@@ -512,7 +961,7 @@ class Bass(Pattern):
         W = [exp(-x) for x in L]
         default_note_amount = random.choices(L, weights=W, k=1)[0]
         self.note_amount = note_amount if note_amount is not None else default_note_amount
-        self.allowed_range = range(23, 49)
+        self.allowed_range = PitchSet.from_range(23, 49)
     
     def generate_rhythm(self):
         start_times = sorted(random.sample(range(self.length), self.note_amount))
@@ -523,9 +972,13 @@ class Bass(Pattern):
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self):
-        all_notes = [x for x in self.scale if x <= 48]
+        all_notes = self.register(high=48).notes
         self.notes = self.sample_notes(self.repeat, all_notes) * self.note_amount
 
+    def batch_generate_melody(self, k, rng=None):
+        all_notes = self.register(high=48).notes
+        return np.tile(self.batch_sample_notes(k, self.repeat, all_notes, rng=rng), self.note_amount)
+
 
 class SimpleBass(Pattern):
     """
@@ -533,7 +986,7 @@ class SimpleBass(Pattern):
     """
     def __init__(self, key, scale, length=None, repeat=None, note_amount=None):
         super().__init__(key, scale, length, repeat)
-        self.allowed_range = range(23, 49)
+        self.allowed_range = PitchSet.from_range(23, 49)
         self.note_amount = 1
 
     def generate_rhythm(self):
@@ -542,27 +995,39 @@ class SimpleBass(Pattern):
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self):
-        all_notes = [x for x in self.scale if x <= 48]
+        all_notes = self.register(high=48).notes
         self.notes = self.sample_notes(self.repeat, all_notes) * self.note_amount
 
+    def batch_generate_melody(self, k, rng=None):
+        all_notes = self.register(high=48).notes
+        return np.tile(self.batch_sample_notes(k, self.repeat, all_notes, rng=rng), self.note_amount)
+
 
 class SimpleBass2(SimpleBass):
     """
     Plays one note that is the length of the pattern and that may change for repeats.
     """
     def generate_melody(self):
-        all_notes = [x for x in self.scale if x <= 48]
+        all_notes = self.register(high=48).notes
         self.notes = self.sample_notes(self.note_amount, all_notes) * self.repeat
 
+    def batch_generate_melody(self, k, rng=None):
+        all_notes = self.register(high=48).notes
+        return np.tile(self.batch_sample_notes(k, self.note_amount, all_notes, rng=rng), self.repeat)
+
 
 class SimpleBass3(Bass):
     """
     Plays the key/mode center only. The rhythm generation is the same as in the base pattern 'Bass'.
     """
     def generate_melody(self):
-        all_notes = [x for x in self.scale if x <= 48 and x%12 == self.key]
+        all_notes = self.register(high=48, pitch_class=self.key).notes
         self.notes = self.sample_notes(self.repeat, all_notes) * self.note_amount
 
+    def batch_generate_melody(self, k, rng=None):
+        all_notes = self.register(high=48, pitch_class=self.key).notes
+        return np.tile(self.batch_sample_notes(k, self.repeat, all_notes, rng=rng), self.note_amount)
+
 
 class Melodic(Pattern, ABC):
     """
@@ -572,7 +1037,7 @@ class Melodic(Pattern, ABC):
         super().__init__(key, scale, length, repeat)
         default_note_amount = random.randint(1, self.length)
         self.note_amount = note_amount if note_amount is not None else default_note_amount
-        self.allowed_range = range(36, 97)
+        self.allowed_range = PitchSet.from_range(36, 97)
 
     def generate_rhythm(self):
         start_times = sorted(random.sample(range(self.length), self.note_amount))
@@ -580,40 +1045,55 @@ class Melodic(Pattern, ABC):
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self, note_range):
-        all_notes = [x for x in self.scale if x in note_range]
+        all_notes = self.register(note_range.start, note_range.stop - 1).notes
         self.notes = self.sample_notes(self.note_amount, all_notes) * self.repeat
 
+    def batch_generate_melody(self, k, rng=None):
+        note_range = self.note_range()
+        all_notes = self.register(note_range.start, note_range.stop - 1).notes
+        return np.tile(self.batch_sample_notes(k, self.note_amount, all_notes, rng=rng), self.repeat)
+
 
 class LowMelodic(Melodic):
+    def note_range(self):
+        return range(self.key + 36, self.key + 61)
+
     def generate_melody(self):
-        allowed_notes = range(self.key + 36, self.key + 61)
-        super().generate_melody(allowed_notes)
+        super().generate_melody(self.note_range())
 
 
 class MidMelodic(Melodic):
+    def note_range(self):
+        return range(self.key + 48, self.key + 73)
+
     def generate_melody(self):
-        allowed_notes = range(self.key + 48, self.key + 73)
-        super().generate_melody(allowed_notes)
+        super().generate_melody(self.note_range())
 
 
 class HighMelodic(Melodic):
+    def note_range(self):
+        return range(self.key + 60, self.key + 85)
+
     def generate_melody(self):
-        allowed_notes = range(self.key + 60, self.key + 85)
-        super().generate_melody(allowed_notes)
+        super().generate_melody(self.note_range())
 
 
 class Harmonic(Pattern):
     """
     Simple harmony-type pattern. Plays long sustained notes that start at the same time 
     at the beginning of the pattern.
+
+    If voicing (a realized chord, e.g. from ChordProgression.voiced_chords) is given, 
+    the pattern plays exactly those notes.
     """
-    def __init__(self, key, scale, length=None, repeat=None, note_amount=None, root_note=None):
+    def __init__(self, key, scale, length=None, repeat=None, note_amount=None, root_note=None, voicing=None):
         super().__init__(key, scale, length, repeat)
         default_root_note = random.choice(self.scale) % 12
-        default_note_amount = random.randint(3, 6)
+        default_note_amount = random.randint(3, 6) if voicing is None else len(voicing)
         self.root_note = root_note if root_note is not None else default_root_note
         self.note_amount = note_amount if note_amount is not None else default_note_amount
-        self.allowed_range = range(48, 85)
+        self.voicing = list(voicing) if voicing is not None else None
+        self.allowed_range = PitchSet.from_range(48, 85)
 
     def generate_rhythm(self):
         start_times = [0] * self.note_amount
@@ -621,22 +1101,36 @@ class Harmonic(Pattern):
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self):
-        all_notes = [x for x in self.scale if self.key + 48 <= x <= self.key + 72]
-        self.notes = self.sample_arpeggio_notes(all_notes, self.root_note) * self.repeat
+        if self.voicing is not None:
+            self.notes = [self.voicing[i % len(self.voicing)] for i in range(self.note_amount)] * self.repeat
+            return
+        view = self.register(self.key + 48, self.key + 72)
+        self.notes = self.sample_arpeggio_notes(view.notes, self.root_note, view.index) * self.repeat
+
+    def batch_generate_melody(self, k, rng=None):
+        if self.voicing is not None:
+            notes = [self.voicing[i % len(self.voicing)] for i in range(self.note_amount)]
+            return np.tile(np.array(notes, dtype=np.int64), (k, self.repeat))
+        view = self.register(self.key + 48, self.key + 72)
+        return np.tile(self.batch_sample_arpeggio_notes(k, view.notes, self.root_note, rng, view.index), self.repeat)
 
 
 class Arpeggio(Pattern):
     """
     Arpeggio type pattern. Notes are sampled in the same way as in the 'Harmonic' pattern 
     but played in sequence.
+
+    If voicing (a realized chord, e.g. from ChordProgression.voiced_chords) is given, 
+    the pattern steps through its notes cyclically instead.
     """
-    def __init__(self, key, scale, length=None, repeat=None, note_amount=None, root_note=None):
+    def __init__(self, key, scale, length=None, repeat=None, note_amount=None, root_note=None, voicing=None):
         super().__init__(key, scale, length, repeat)
         default_root_note = random.choice(self.scale) % 12
         default_note_amount = self.length
         self.root_note = root_note if root_note is not None else default_root_note
         self.note_amount = note_amount if note_amount is not None else default_note_amount
-        self.allowed_range = range(36, 85)
+        self.voicing = list(voicing) if voicing is not None else None
+        self.allowed_range = PitchSet.from_range(36, 85)
 
     def generate_rhythm(self):
         start_times = list(range(self.length))
@@ -644,5 +1138,15 @@ class Arpeggio(Pattern):
         self.repeat_rhythm(start_times, durations)
 
     def generate_melody(self):
-        all_notes = [x for x in self.scale if self.key + 36 <= x <= self.key + 72]
-        self.notes = self.sample_arpeggio_notes(all_notes, self.root_note) * self.repeat
+        if self.voicing is not None:
+            self.notes = [self.voicing[i % len(self.voicing)] for i in range(self.note_amount)] * self.repeat
+            return
+        view = self.register(self.key + 36, self.key + 72)
+        self.notes = self.sample_arpeggio_notes(view.notes, self.root_note, view.index) * self.repeat
+
+    def batch_generate_melody(self, k, rng=None):
+        if self.voicing is not None:
+            notes = [self.voicing[i % len(self.voicing)] for i in range(self.note_amount)]
+            return np.tile(np.array(notes, dtype=np.int64), (k, self.repeat))
+        view = self.register(self.key + 36, self.key + 72)
+        return np.tile(self.batch_sample_arpeggio_notes(k, view.notes, self.root_note, rng, view.index), self.repeat)
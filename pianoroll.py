@@ -0,0 +1,91 @@
+import numpy as np
+
+from music.events import EVENT_DTYPE
+
+
+def piano_roll_indices(events):
+    """
+    Sparse (COO) piano roll of a song at 1/16th note resolution.
+
+    Every note in events (array of EVENT_DTYPE records, e.g. EventTable.to_array())
+    is expanded to one entry per 1/16th note step it sounds. Returns the arrays
+    (time, pitch, track, velocity) of equal length.
+    """
+    durations = events['duration'].astype(np.int64)
+    note_idxs = np.repeat(np.arange(len(events)), durations)
+    # Step of each entry within its note: 0, 1, ..., duration - 1
+    note_first_entry = np.cumsum(durations) - durations
+    steps = np.arange(len(note_idxs)) - note_first_entry[note_idxs]
+    time = events['start'].astype(np.int64)[note_idxs] + steps
+    return time, events['pitch'][note_idxs], events['track'][note_idxs], events['velocity'][note_idxs]
+
+
+def song_length(events):
+    """
+    Length of a song in 1/16th note steps (end of its last note).
+    """
+    if len(events) == 0:
+        return 0
+    return int((events['start'].astype(np.int64) + events['duration']).max())
+
+
+def piano_roll(events, num_tracks=None, length=None):
+    """
+    Dense piano roll of a song as a (time, 128, tracks) uint8 array of velocities.
+
+    Overlapping notes of the same pitch and track keep the highest velocity. The number
+    of tracks and the length default to the ones used in events.
+    """
+    if num_tracks is None:
+        num_tracks = int(events['track'].max()) + 1 if len(events) else 0
+    if length is None:
+        length = song_length(events)
+    roll = np.zeros((length, 128, num_tracks), dtype=np.uint8)
+    time, pitch, track, velocity = piano_roll_indices(events)
+    np.maximum.at(roll, (time, pitch, track), velocity)
+    return roll
+
+
+def pad_piano_rolls(songs, num_tracks=None):
+    """
+    Piano rolls of several songs (list of event arrays) stacked along a batch axis.
+
+    All rolls are built with a single scatter and zero-padded to the length of the longest
+    song. Returns the (songs, time, 128, tracks) array and the length of each song.
+    """
+    lengths = np.array([song_length(events) for events in songs], dtype=np.int64)
+    events = np.concatenate(songs) if len(songs) else np.empty(0, dtype=EVENT_DTYPE)
+    if num_tracks is None:
+        num_tracks = int(events['track'].max()) + 1 if len(events) else 0
+    song_idxs = np.repeat(np.arange(len(songs)), [len(x) for x in songs])
+
+    rolls = np.zeros((len(songs), lengths.max(initial=0), 128, num_tracks), dtype=np.uint8)
+    time, pitch, track, velocity = piano_roll_indices(events)
+    song_idxs = np.repeat(song_idxs, events['duration'].astype(np.int64))
+    np.maximum.at(rolls, (song_idxs, time, pitch, track), velocity)
+    return rolls, lengths
+
+
+def bucket_piano_rolls(songs, bucket_length, num_tracks=None):
+    """
+    Piano rolls of several songs (list of event arrays) grouped into buckets by length.
+
+    Each song is placed in the bucket of its length rounded up to a multiple of
+    bucket_length, so that songs are padded by less than bucket_length steps. Returns
+    a dict {bucket length: (rolls, song indices)} where rolls is a
+    (songs in bucket, bucket length, 128, tracks) array.
+    """
+    if num_tracks is None:
+        num_tracks = max((int(x['track'].max()) + 1 for x in songs if len(x)), default=0)
+    lengths = np.array([song_length(events) for events in songs], dtype=np.int64)
+    bucket_lengths = -(-lengths // bucket_length) * bucket_length
+
+    buckets = {}
+    for padded_length in np.unique(bucket_lengths):
+        song_idxs = np.flatnonzero(bucket_lengths == padded_length)
+        rolls, _ = pad_piano_rolls([songs[i] for i in song_idxs], num_tracks)
+        if rolls.shape[1] < padded_length:
+            padding = ((0, 0), (0, padded_length - rolls.shape[1]), (0, 0), (0, 0))
+            rolls = np.pad(rolls, padding)
+        buckets[int(padded_length)] = (rolls, song_idxs)
+    return buckets
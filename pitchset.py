@@ -0,0 +1,128 @@
+# Number of MIDI notes and the mask with all of them set
+num_notes = 128
+all_notes_mask = (1 << num_notes) - 1
+
+# One bit at each C, repeating a 12-bit pitch class mask over all octaves
+octave_bits = sum(1 << (12 * octave) for octave in range(num_notes // 12 + 1))
+
+
+def range_mask(low, high):
+    """
+    Mask of the notes in range(low, high), clipped to the MIDI notes 0-127.
+    """
+    low, high = max(low, 0), min(high, num_notes)
+    if low >= high:
+        return 0
+    return ((1 << high) - 1) ^ ((1 << low) - 1)
+
+
+class PitchSet:
+    """
+    Set of MIDI notes stored as a 128-bit mask (bit i is note i).
+
+    Membership, transposition (a shift of the mask), intersection with a register and
+    the set operations are single integer operations. Iterating yields the notes in
+    ascending order. Notes outside 0-127 are dropped.
+
+    Attributes:
+        mask: int   128-bit mask of the notes in the set.
+    """
+    __slots__ = ('mask',)
+
+    def __init__(self, notes=(), mask=0):
+        for note in notes:
+            if 0 <= note < num_notes:
+                mask |= 1 << note
+        self.mask = mask & all_notes_mask
+
+    @classmethod
+    def from_range(cls, low, high):
+        """
+        All notes in range(low, high) (clipped to 0-127).
+        """
+        return cls(mask=range_mask(low, high))
+
+    @classmethod
+    def from_pitch_classes(cls, pitch_classes, low=0, high=num_notes):
+        """
+        All notes in range(low, high) whose pitch class (note % 12) is in pitch_classes.
+        """
+        pitch_class_mask = 0
+        for pitch_class in pitch_classes:
+            pitch_class_mask |= 1 << (pitch_class % 12)
+        return cls(mask=pitch_class_mask * octave_bits & range_mask(low, high))
+
+    @property
+    def pitch_class_mask(self):
+        """
+        12-bit mask of the pitch classes of the notes (bit i is pitch class i).
+        """
+        mask, pitch_class_mask = self.mask, 0
+        while mask:
+            pitch_class_mask |= mask & 0xFFF
+            mask >>= 12
+        return pitch_class_mask
+
+    @property
+    def pitch_classes(self):
+        """
+        Sorted pitch classes of the notes.
+        """
+        pitch_class_mask = self.pitch_class_mask
+        return [i for i in range(12) if pitch_class_mask >> i & 1]
+
+    def transpose(self, shift):
+        """
+        The set shifted by shift semitones. Notes shifted out of 0-127 are dropped.
+        """
+        mask = self.mask << shift if shift >= 0 else self.mask >> -shift
+        return PitchSet(mask=mask)
+
+    def register(self, low, high):
+        """
+        The notes of the set in range(low, high).
+        """
+        return PitchSet(mask=self.mask & range_mask(low, high))
+
+    def rank(self, note):
+        """
+        Number of notes in the set below note, i.e. the index of note in list(self).
+        """
+        return bin(self.mask & range_mask(0, note)).count('1')
+
+    def lowest(self):
+        """
+        Lowest note of the set (None if empty).
+        """
+        return (self.mask & -self.mask).bit_length() - 1 if self.mask else None
+
+    def __contains__(self, note):
+        return 0 <= note < num_notes and (self.mask >> note) & 1 == 1
+
+    def __iter__(self):
+        mask = self.mask
+        while mask:
+            low_bit = mask & -mask
+            yield low_bit.bit_length() - 1
+            mask ^= low_bit
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __and__(self, other):
+        return PitchSet(mask=self.mask & other.mask)
+
+    def __or__(self, other):
+        return PitchSet(mask=self.mask | other.mask)
+
+    def __sub__(self, other):
+        return PitchSet(mask=self.mask & ~other.mask)
+
+    def __eq__(self, other):
+        return isinstance(other, PitchSet) and self.mask == other.mask
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def __repr__(self):
+        return f'PitchSet({list(self)})'
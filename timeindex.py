@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class TimeIndex:
+    """
+    Per-track time index of the note events of a song for windowed queries and seeking.
+
+    The events of each track are kept sorted by start time together with their end
+    times. A note sounds in [t0, t1) if it starts before t1 and ends after t0. To find
+    the notes ending after t0 without scanning back to the start of every sustained
+    note, the notes of a track are split into duration classes (durations in
+    [2**c, 2**(c+1))): a note of class c sounding at t0 starts after t0 - (longest
+    duration of the class), and at least half of the notes of the class that start in
+    that range still sound at t0. Both bounds are found by binary search per class, so
+    one long note only widens the search among notes of similar length.
+
+    Attributes:
+        events: np.ndarray      Array of EVENT_DTYPE records (e.g. EventTable.to_array()).
+        tracks: dict[int, tuple]    (event indices, starts, ends, duration classes) of each
+                                track, sorted by start time. Each duration class is 
+                                (positions in the track, starts, ends, longest duration).
+    """
+    def __init__(self, events):
+        self.events = events
+        self.tracks = {}
+        order = np.lexsort((events['start'], events['track']))
+        sorted_tracks = events['track'][order]
+        track_numbers, first_idxs = np.unique(sorted_tracks, return_index=True)
+        last_idxs = list(first_idxs[1:]) + [len(order)]
+        for track, first, last in zip(track_numbers, first_idxs, last_idxs):
+            idxs = order[first:last]
+            starts = events['start'][idxs].astype(np.int64)
+            durations = events['duration'][idxs].astype(np.int64)
+            ends = starts + durations
+            duration_classes = np.log2(np.maximum(durations, 1)).astype(np.int64)
+            classes = []
+            for duration_class in np.unique(duration_classes):
+                positions = np.flatnonzero(duration_classes == duration_class)
+                classes.append((positions, starts[positions], ends[positions], int(durations[positions].max())))
+            self.tracks[int(track)] = (idxs, starts, ends, classes)
+
+    def window_idxs(self, t0, t1, track=None):
+        """
+        Indices into self.events of the notes sounding in [t0, t1), ordered by track and
+        start time. Only the given track is searched if track is not None.
+        """
+        tracks = [track] if track is not None else sorted(self.tracks)
+        window_idxs = []
+        for track in tracks:
+            if track not in self.tracks:
+                continue
+            idxs, _, _, classes = self.tracks[track]
+            positions = []
+            for class_positions, starts, ends, max_duration in classes:
+                lo = np.searchsorted(starts, t0 - max_duration, side='right')
+                hi = np.searchsorted(starts, t1, side='left')
+                positions.append(class_positions[lo:hi][ends[lo:hi] > t0])
+            window_idxs.append(idxs[np.sort(np.concatenate(positions))])
+        return np.concatenate(window_idxs) if window_idxs else np.empty(0, dtype=np.int64)
+
+    def window(self, t0, t1, track=None):
+        """
+        Events sounding in [t0, t1), including sustained notes that started before t0.
+        """
+        return self.events[self.window_idxs(t0, t1, track)]
+
+    def starting(self, t0, t1, track=None):
+        """
+        Events starting in [t0, t1), e.g. for streaming a song from position t0.
+        """
+        tracks = [track] if track is not None else sorted(self.tracks)
+        start_idxs = []
+        for track in tracks:
+            if track not in self.tracks:
+                continue
+            idxs, starts, _, _ = self.tracks[track]
+            lo, hi = np.searchsorted(starts, [t0, t1], side='left')
+            start_idxs.append(idxs[lo:hi])
+        idxs = np.concatenate(start_idxs) if start_idxs else np.empty(0, dtype=np.int64)
+        return self.events[idxs]
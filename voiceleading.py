@@ -0,0 +1,83 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def chord_pitch_classes(key, mode, scale_degree, voicing):
+    """
+    Pitch classes of a chord built on scale_degree of the scale (key, mode) with voicing
+    (zero-based scale degrees, as in ChordProgression.basic_voicings). Repeated pitch
+    classes are dropped, keeping the voicing order.
+    """
+    pitch_classes = [(key + mode[(scale_degree + x) % len(mode)]) % 12 for x in voicing]
+    return tuple(dict.fromkeys(pitch_classes))
+
+
+@lru_cache(maxsize=None)
+def candidate_voicings(pitch_classes, low, high):
+    """
+    Candidate realizations of a chord in range(low, high): every inversion of the chord
+    in closed position (each note the next pitch class above the previous note), at
+    every octave where it fits. Returns a tuple of ascending note tuples.
+    """
+    candidates = []
+    for inversion in range(len(pitch_classes)):
+        order = pitch_classes[inversion:] + pitch_classes[:inversion]
+        for bass in range(low, high):
+            if bass % 12 != order[0]:
+                continue
+            notes = [bass]
+            for pitch_class in order[1:]:
+                notes.append(notes[-1] + (pitch_class - notes[-1]) % 12)
+            if notes[-1] < high:
+                candidates.append(tuple(notes))
+    return tuple(candidates)
+
+
+def movement(chord1, chord2):
+    """
+    Voice movement in semitones between two ascending chords. Chords of equal size move
+    voice by voice; otherwise every note moves to the nearest note of the other chord.
+    """
+    if len(chord1) == len(chord2):
+        return sum(abs(x - y) for x, y in zip(chord1, chord2))
+    return (sum(min(abs(x - y) for y in chord2) for x in chord1)
+            + sum(min(abs(x - y) for x in chord1) for y in chord2))
+
+
+@lru_cache(maxsize=None)
+def transition_costs(candidates1, candidates2):
+    """
+    Matrix of the movement from each candidate of one chord to each of the next chord.
+    These are the edges of the chord graph, computed once per pair of chords.
+    """
+    return np.array([[movement(x, y) for y in candidates2] for x in candidates1], dtype=float)
+
+
+def voice_lead(chords, low, high):
+    """
+    Realize a progression of chords (pitch class tuples) in range(low, high) with the
+    least total voice movement.
+
+    Each chord is a layer of candidate voicings (see candidate_voicings) and the best
+    path through the layers is found with the Viterbi algorithm: the cheapest cost of
+    reaching each candidate is carried forward one chord at a time and the path is
+    traced back at the end, so the time is linear in the progression length. The first
+    chord prefers voicings near the middle of the range. Returns one note tuple per chord.
+    """
+    layers = [candidate_voicings(tuple(x), low, high) for x in chords]
+    assert all(layers), 'range too small for some chords of the progression'
+    center = (low + high - 1) / 2
+    costs = np.array([abs(np.mean(x) - center) for x in layers[0]])
+    back_pointers = []
+    for previous, current in zip(layers, layers[1:]):
+        total = costs[:, None] + transition_costs(previous, current)
+        back_pointers.append(total.argmin(axis=0))
+        costs = total.min(axis=0)
+
+    path = [int(costs.argmin())]
+    for pointers in reversed(back_pointers):
+        path.append(int(pointers[path[-1]]))
+    path.reverse()
+    return [layer[i] for layer, i in zip(layers, path)]